@@ -6,38 +6,81 @@ INFO = 3
 DEBUG = 4
 TRACE = 5
 
+# level -> (char, color, bright)
+_LEVEL_STYLE = {
+    ERROR: ("E", c.RED, False),
+    WARN: ("W", c.YELLOW, False),
+    INFO: ("I", c.GREEN, False),
+    DEBUG: ("D", c.WHITE, False),
+    TRACE: ("T", c.BLACK, True)
+}
+
+_RESET = c.reset()
+
+class StdoutSink:
+    """Colored output on stdout (serial console on the device)."""
+
+    @staticmethod
+    def emit(logger, level, msg):
+        print(logger.prefix(level) + msg + _RESET)
+
+# every message that passes its logger's level goes to all sinks,
+# a sink is any object with emit(logger, level, msg)
+_sinks = [StdoutSink]
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+def level_char(level):
+    return _LEVEL_STYLE[level][0]
+
 class Logger:
+    """Messages are format strings, args are applied only when the level is enabled:
+        logger.debug("connection from {}:{}.", ip, port)"""
+
     def __init__(self, tag, loglevel=INFO):
         self.tag = tag
         self.loglevel = loglevel
 
-    @staticmethod
-    def write(msg):
-        # for now standard print to stdout
-        print(msg)
+        # color code and tag for every level, built once
+        self._prefixes = {}
+        for level in _LEVEL_STYLE:
+            char, color, bright = _LEVEL_STYLE[level]
+            self._prefixes[level] = c.getCode(color, bright=bright) + "[{} {}] ".format(char, tag)
+
+    def prefix(self, level):
+        return self._prefixes[level]
+
+    def enabled(self, level):
+        """Cheap check for guarding expensive log arguments."""
+        return self.loglevel >= level
+
+    def _write_level(self, level, msg, args):
+        if args:
+            msg = msg.format(*args)
 
-    def _write_level(self, msg, char, color=c.WHITE, bright=False):
-        out = c.getCode(color, bright=bright)
-        out += "[{} {}] ".format(char, self.tag)
-        out += msg+c.reset()
-        self.write(out)
+        for sink in _sinks:
+            sink.emit(self, level, msg)
 
-    def error(self, msg):
+    def error(self, msg, *args):
         if self.loglevel >= ERROR:
-            self._write_level(msg, "E", color=c.RED)
+            self._write_level(ERROR, msg, args)
 
-    def warn(self, msg):
+    def warn(self, msg, *args):
         if self.loglevel >= WARN:
-            self._write_level(msg, "W", color=c.YELLOW)
+            self._write_level(WARN, msg, args)
 
-    def info(self, msg):
+    def info(self, msg, *args):
         if self.loglevel >= INFO:
-            self._write_level(msg, "I", color=c.GREEN)
+            self._write_level(INFO, msg, args)
 
-    def debug(self, msg):
+    def debug(self, msg, *args):
         if self.loglevel >= DEBUG:
-            self._write_level(msg, "D")
+            self._write_level(DEBUG, msg, args)
 
-    def trace(self, msg):
+    def trace(self, msg, *args):
         if self.loglevel >= TRACE:
-            self._write_level(msg, "T", color=c.BLACK, bright=True)
\ No newline at end of file
+            self._write_level(TRACE, msg, args)
\ No newline at end of file
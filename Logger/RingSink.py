@@ -0,0 +1,58 @@
+import Logger.Logger as Logger
+
+class RingSink:
+    """Keeps the last size log records in preallocated slots.
+
+    Every record gets a sequence number, readers use it as a cursor (since)
+    to fetch only records they haven't seen yet. Records more verbose than
+    loglevel are not kept, whatever the logger's own level."""
+
+    def __init__(self, size=64, loglevel=Logger.INFO):
+        self._size = size
+        self.loglevel = loglevel
+        # slots only hold references, emitting doesn't allocate
+        self._msgs = [None] * size
+        self._tags = [None] * size
+        self._levels = bytearray(size)
+        # sequence number of the next record
+        self._seq = 0
+
+    def emit(self, logger, level, msg):
+        if level > self.loglevel:
+            return
+
+        i = self._seq % self._size
+        self._msgs[i] = msg
+        self._tags[i] = logger.tag
+        self._levels[i] = level
+        self._seq += 1
+
+    def next_seq(self):
+        return self._seq
+
+    def first_seq(self):
+        """Oldest record still in the buffer."""
+        return max(0, self._seq - self._size)
+
+    def lines(self, since, until, chunk=256):
+        """Yields records from since up to (excluding) until as text,
+        "<seq> <level> <tag> <msg>" per line, grouped into strings of about chunk characters.
+
+        Records overwritten while the output is being sent are skipped."""
+
+        seq = max(since, self.first_seq())
+
+        out = ""
+        while seq < until:
+            if seq >= self._seq - self._size:
+                i = seq % self._size
+                out += "{} {} {} {}\n".format(seq, Logger.level_char(self._levels[i]), self._tags[i], self._msgs[i])
+
+                if len(out) >= chunk:
+                    yield out
+                    out = ""
+
+            seq += 1
+
+        if out:
+            yield out
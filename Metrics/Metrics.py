@@ -0,0 +1,144 @@
+import gc
+import time
+import uasyncio as asyncio
+
+# request handling time buckets (ms), upper bounds
+MS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+def _label_str(labels, quote):
+    if not labels:
+        return ""
+
+    if quote:
+        # prometheus: name{key="value"}
+        parts = ["{}=\"{}\"".format(key, labels[key]) for key in labels]
+    else:
+        parts = ["{}={}".format(key, labels[key]) for key in labels]
+
+    return "{" + ",".join(parts) + "}"
+
+class Counter:
+    """Monotonic count. With fn, the value is read from fn() at collection time."""
+    TYPE = "counter"
+
+    def __init__(self, name, labels=None, fn=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._fn = fn
+
+    def inc(self, n=1):
+        self.value += n
+
+    def get(self):
+        return self._fn() if self._fn != None else self.value
+
+class Gauge(Counter):
+    """Current value, set() or read from fn() at collection time."""
+    TYPE = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    """Fixed buckets, counts are kept per bucket (not cumulative) in a preallocated list."""
+    TYPE = "histogram"
+
+    def __init__(self, name, labels=None, buckets=MS_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        # last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            i += 1
+
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    def __init__(self):
+        # name -> list of metrics with that name (differing in labels)
+        self._families = {}
+        # registration order of names
+        self._names = []
+
+    def register(self, metric):
+        if metric.name not in self._families:
+            self._families[metric.name] = []
+            self._names.append(metric.name)
+
+        self._families[metric.name].append(metric)
+        return metric
+
+    def counter(self, name, labels=None, fn=None):
+        return self.register(Counter(name, labels, fn))
+
+    def gauge(self, name, labels=None, fn=None):
+        return self.register(Gauge(name, labels, fn))
+
+    def histogram(self, name, labels=None, buckets=MS_BUCKETS):
+        return self.register(Histogram(name, labels, buckets))
+
+    def to_json(self):
+        """Compact form: {"name{label=value}": value}, histograms as {"count", "sum", "buckets"}."""
+        out = {}
+        for name in self._names:
+            for metric in self._families[name]:
+                key = name + _label_str(metric.labels, False)
+                if metric.TYPE == "histogram":
+                    out[key] = {"count": metric.count, "sum": metric.sum, "buckets": metric.counts}
+                else:
+                    out[key] = metric.get()
+
+        return out
+
+    def prometheus(self):
+        """Yields the Prometheus text exposition format, one family per chunk."""
+        for name in self._names:
+            family = self._families[name]
+            out = "# TYPE {} {}\n".format(name, family[0].TYPE)
+
+            for metric in family:
+                if metric.TYPE == "histogram":
+                    cumulative = 0
+                    for i, bound in enumerate(metric.buckets):
+                        cumulative += metric.counts[i]
+                        labels = dict(metric.labels) if metric.labels else {}
+                        labels["le"] = bound
+                        out += "{}_bucket{} {}\n".format(name, _label_str(labels, True), cumulative)
+
+                    labels = dict(metric.labels) if metric.labels else {}
+                    labels["le"] = "+Inf"
+                    out += "{}_bucket{} {}\n".format(name, _label_str(labels, True), metric.count)
+                    out += "{}_sum{} {}\n".format(name, _label_str(metric.labels, True), metric.sum)
+                    out += "{}_count{} {}\n".format(name, _label_str(metric.labels, True), metric.count)
+
+                else:
+                    value = metric.get()
+                    # no sample yet (i.e. a gauge read from fn before the first measurement)
+                    if value != None:
+                        out += "{}{} {}\n".format(name, _label_str(metric.labels, True), value)
+
+            yield out
+
+# shared by all modules
+REGISTRY = Registry()
+
+REGISTRY.gauge("free_heap_bytes", fn=gc.mem_free)
+loop_lag = REGISTRY.gauge("event_loop_lag_ms")
+
+async def monitor_loop_lag(interval_ms=1000):
+    """Measures how late the event loop wakes a sleeping task (blocking code elsewhere)."""
+    while True:
+        start = time.ticks_ms()
+        await asyncio.sleep_ms(interval_ms)
+        loop_lag.set(max(0, time.ticks_diff(time.ticks_ms(), start) - interval_ms))
@@ -1,7 +1,8 @@
 import socket
-import select
 import uasyncio as asyncio
 from Multicast.MulticastException import MulticastException, BAD_REQUEST
+from Multicast.RateLimiter import RateLimiter
+from Metrics.Metrics import REGISTRY
 import Logger.Logger as Logger
 from WiFi import WiFi
 
@@ -10,17 +11,47 @@ from WiFi import WiFi
 MCAST_GRP_IF = bytes(b'\xef\xff\xad?\x00\x00\x00\x00')
 MCAST_PORT = 1200
 BUFSIZE = 32
+# ms between attempts to rejoin the group after a failed join
+REJOIN_RETRY_MS = 1000
+
+class _Readable:
+    """Awaitable that parks the task on the event loop's poller until sock is readable."""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def __iter__(self):
+        yield asyncio.core._io_queue.queue_read(self._sock)
+
+    # CPython protocol
+    __await__ = __iter__
 
 class Multicast:
-    def __init__(self, name, wifi: WiFi, loglevel=Logger.INFO):
+    def __init__(self, name, wifi: WiFi, loglevel=Logger.INFO, rate=2, burst=4, reply_errors=True):
         self.name = name.lower()
         self.wifi = wifi
         self._logger = Logger.Logger("mcast", loglevel=loglevel)
 
+        # ID reply, rebuilt only after Wi-Fi mode/IP change
+        self._id_reply = None
+        wifi.on_change(self._interface_changed)
+
+        # replies (ID and ERR) per source ip
+        self._limiter = RateLimiter(rate=rate, burst=burst)
+        self._reply_errors = reply_errors
+
+        self.served = 0
+        self.dropped = 0
+        self.errors = 0
+        REGISTRY.counter("mcast_served_total", fn=lambda: self.served)
+        REGISTRY.counter("mcast_dropped_total", fn=lambda: self.dropped)
+        REGISTRY.counter("mcast_errors_total", fn=lambda: self.errors)
+
         self._srv_sock = None
-        self._poll = None
+        self._task = None
+        # retries the group join after an interface change, None when joined
+        self._rejoin_task = None
 
-        self._should_listen = True
         self._stopped_listening = asyncio.Event()
         self._stopped_listening.set()
 
@@ -34,67 +65,146 @@ class Multicast:
         # join multicast group
         self._srv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, MCAST_GRP_IF)
 
-        self._poll = select.poll()
-        self._poll.register(self._srv_sock)
-
         self._stopped_listening.clear()
-        self._should_listen = True
-
-        asyncio.create_task(self._listen())
+        self._task = asyncio.create_task(self._listen())
         self._logger.info("multicast listener started.")
 
-    def _listen(self):
-        while self._should_listen:
-            for s, ev in self._poll.ipoll():
-                if ev & select.POLLIN:
-                    buf, (c_ip, c_port) = s.recvfrom(BUFSIZE)
-                    self._logger.debug("multicast request from {}:{}.".format(c_ip, c_port))
-                    c_port = int(c_port)
-                    buf = buf.decode()
+    async def _listen(self):
+        try:
+            while True:
+                # woken by the event loop only when there is something to read
+                await _Readable(self._srv_sock)
 
+                # drain every queued datagram
+                while True:
                     try:
-                        try:
-                            action, params = buf.split(" ", 1)
-                            params = params.split(" ")
-                        except ValueError:
-                            raise MulticastException(BAD_REQUEST, "error unpacking action/parameters")
-
-                        self._logger.trace("action: {}, params: {}.".format(action, params))
-
-                        if action == "ID":
-                            # identify
-                            try:
-                                name = params[0].lower()
-                            except IndexError:
-                                raise MulticastException(BAD_REQUEST, "error unpacking parameters in {}".format(action))
+                        buf, (c_ip, c_port) = self._srv_sock.recvfrom(BUFSIZE)
+                    except OSError:
+                        # EAGAIN, queue empty
+                        break
 
-                            if name == "any" or name == self.name:
-                                self._logger.info("-> {} {}".format(action, name))
-
-                                self._logger.trace("responding ID {} {}.".format(self.name, self.wifi.get_current_ip()))
-                                self._srv_sock.sendto("ID {} {}".format(self.name, self.wifi.get_current_ip()).encode(), (c_ip, c_port))
-
-                        # TODO add more actions
-                        else:
-                            raise MulticastException(BAD_REQUEST, "action not supported: {}".format(action))
-
-                        self._logger.debug("response sent")
-
-                    except MulticastException as e:
-                        self._logger.warn("{}, code={}.".format(e.msg, e.code))
-                        self._srv_sock.sendto("ERR {} {}".format(e.code, e.msg).encode(), (c_ip, c_port))
-
-
-            await asyncio.sleep(0.1)
-
-        self._poll.unregister(self._srv_sock)
-        self._srv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, MCAST_GRP_IF)
-
-        self._stopped_listening.set()
+                    try:
+                        self._handle(buf, c_ip, int(c_port))
+                    except OSError as e:
+                        # reply not sent, keep listening
+                        self._logger.warn("sendto failed: {}.", e)
+
+        finally:
+            try:
+                self._srv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, MCAST_GRP_IF)
+            except OSError:
+                # not joined (rejoin pending)
+                pass
+            self._srv_sock.close()
+            self._srv_sock = None
+
+            self._stopped_listening.set()
+
+    def _handle(self, buf, c_ip, c_port):
+        self._logger.debug("multicast request from {}:{}.", c_ip, c_port)
+
+        try:
+            try:
+                action, params = buf.decode().split(" ", 1)
+                params = params.split(" ")
+            except ValueError:
+                raise MulticastException(BAD_REQUEST, "error unpacking action/parameters")
+
+            self._logger.trace("action: {}, params: {}.", action, params)
+
+            if action == "ID":
+                # identify
+                try:
+                    name = params[0].lower()
+                except IndexError:
+                    raise MulticastException(BAD_REQUEST, "error unpacking parameters in {}".format(action))
+
+                if name == "any" or name == self.name:
+                    self._logger.info("-> {} {}", action, name)
+
+                    if not self._limiter.allow(c_ip):
+                        self.dropped += 1
+                        self._logger.debug("rate limited {}.", c_ip)
+                        return
+
+                    reply = self._get_id_reply()
+                    self._logger.trace("responding {}.", reply)
+                    self._srv_sock.sendto(reply, (c_ip, c_port))
+                    self.served += 1
+
+            # TODO add more actions
+            else:
+                raise MulticastException(BAD_REQUEST, "action not supported: {}".format(action))
+
+            self._logger.debug("response sent")
+
+        except MulticastException as e:
+            self._logger.warn("{}, code={}.", e.msg, e.code)
+            self.errors += 1
+
+            if not self._reply_errors:
+                return
+
+            if not self._limiter.allow(c_ip):
+                self.dropped += 1
+                return
+
+            self._srv_sock.sendto("ERR {} {}".format(e.code, e.msg).encode(), (c_ip, c_port))
+
+    def _interface_changed(self, wifi):
+        self._id_reply = None
+
+        # membership belongs to the old interface, the socket stays
+        # runs inside WiFi's change callbacks, a failed join must not raise
+        if self._srv_sock != None and self._rejoin_task == None and not self._join():
+            self._rejoin_task = asyncio.create_task(self._rejoin())
+
+    def _join(self):
+        """Moves the group membership to the current interface, False if the join failed."""
+        try:
+            self._srv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, MCAST_GRP_IF)
+        except OSError:
+            pass
+
+        try:
+            self._srv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, MCAST_GRP_IF)
+        except OSError as e:
+            self._logger.warn("multicast group join failed: {}, retrying in {}ms.", e, REJOIN_RETRY_MS)
+            return False
+
+        self._logger.debug("multicast group rejoined.")
+        return True
+
+    async def _rejoin(self):
+        try:
+            while self._srv_sock != None:
+                await asyncio.sleep_ms(REJOIN_RETRY_MS)
+                if self._srv_sock != None and self._join():
+                    break
+        finally:
+            self._rejoin_task = None
+
+    def _get_id_reply(self):
+        if self._id_reply == None:
+            self._id_reply = "ID {} {}".format(self.name, self.wifi.get_current_ip()).encode()
+
+        return self._id_reply
+
+    def stats(self):
+        return {
+            "served": self.served,
+            "dropped": self.dropped,
+            "errors": self.errors
+        }
 
     async def stop(self):
-        self._should_listen = False
+        if self._rejoin_task != None:
+            self._rejoin_task.cancel()
+
+        # listener sleeps on the socket, wake it up by cancelling
+        self._task.cancel()
         await self._stopped_listening.wait()
+        self._task = None
 
         self._logger.info("multicast listener stopped.")
 
@@ -0,0 +1,55 @@
+import time
+
+class RateLimiter:
+    """Per-source token bucket. Each source gets burst tokens, refilled at rate tokens per second.
+
+    A global bucket (global_burst tokens, refilled at global_rate) caps replies from all sources
+    together, many sources (or spoofed ones) can't multiply the reply rate."""
+
+    def __init__(self, rate=2, burst=4, max_sources=16, global_rate=8, global_burst=16):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+
+        # source -> [tokens, last refill ticks_ms]
+        self._buckets = {}
+        self._global = [global_burst, time.ticks_ms()]
+
+    def _refill(self, bucket, rate, burst, now):
+        elapsed = time.ticks_diff(now, bucket[1])
+        bucket[0] = min(burst, bucket[0] + elapsed * rate / 1000)
+        bucket[1] = now
+
+    def _evict(self):
+        # least recently refilled, i.e. the source heard from longest ago
+        oldest = None
+        for source in self._buckets:
+            if oldest == None or time.ticks_diff(self._buckets[source][1], self._buckets[oldest][1]) < 0:
+                oldest = source
+
+        del self._buckets[oldest]
+
+    def allow(self, source):
+        now = time.ticks_ms()
+
+        bucket = self._buckets.get(source)
+        if bucket == None:
+            if len(self._buckets) >= self.max_sources:
+                self._evict()
+
+            bucket = [self.burst, now]
+            self._buckets[source] = bucket
+
+        else:
+            self._refill(bucket, self.rate, self.burst, now)
+
+        self._refill(self._global, self.global_rate, self.global_burst, now)
+
+        if bucket[0] < 1 or self._global[0] < 1:
+            return False
+
+        bucket[0] -= 1
+        self._global[0] -= 1
+        return True
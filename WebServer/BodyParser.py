@@ -0,0 +1,299 @@
+# Incremental request body parsers. The body is fed in chunks as it arrives from the socket,
+# only the token being parsed is buffered (at most max_token bytes), never the whole body.
+#   parser.feed(chunk) ... parser.finish() -> dict
+# Both raise ValueError on malformed input.
+
+_HEX = b"0123456789abcdefABCDEF"
+
+def _hex_val(c):
+    if c <= 57: return c - 48
+    if c <= 70: return c - 55
+    return c - 87
+
+class FormParser:
+    """application/x-www-form-urlencoded, key=value pairs joined with &, percent-encoded, + is space."""
+
+    def __init__(self, max_token=256):
+        self._max_token = max_token
+        self._data = {}
+        self._key = None
+        self._tok = bytearray()
+        # 0 outside escape, 1 or 2 hex digits of %XX still expected
+        self._esc = 0
+        self._esc_val = 0
+
+    def _end_pair(self):
+        if self._esc:
+            raise ValueError("truncated % escape")
+
+        if self._key == None:
+            if len(self._tok) > 0:
+                raise ValueError("no = in a field")
+            # empty pair, i.e. trailing &
+            return
+
+        self._data[self._key] = self._tok.decode()
+        self._key = None
+        self._tok = bytearray()
+
+    def feed(self, chunk):
+        for c in chunk:
+            if self._esc:
+                if c not in _HEX:
+                    raise ValueError("bad % escape")
+                self._esc_val = self._esc_val * 16 + _hex_val(c)
+                self._esc -= 1
+                if self._esc == 0:
+                    self._tok.append(self._esc_val)
+                continue
+
+            if c == 38: # &
+                self._end_pair()
+                continue
+
+            if c == 61 and self._key == None: # =
+                self._key = self._tok.decode()
+                self._tok = bytearray()
+                continue
+
+            if len(self._tok) >= self._max_token:
+                raise ValueError("field longer than {} bytes".format(self._max_token))
+
+            if c == 37: # %
+                self._esc = 2
+                self._esc_val = 0
+            elif c == 43: # +
+                self._tok.append(32)
+            else:
+                self._tok.append(c)
+
+    def finish(self):
+        self._end_pair()
+        return self._data
+
+# JSONParser states, what comes next
+_VALUE = 0          # any value
+_VALUE_OR_END = 1   # value or ], right after [
+_KEY = 2            # string key
+_KEY_OR_END = 3     # key or }, right after {
+_COLON = 4
+_NEXT = 5           # , or closing bracket
+_DONE = 6           # only whitespace
+_STRING = 7
+_NUMBER = 8
+_LITERAL = 9
+
+_WS = b" \t\r\n"
+_NUM = b"+-0123456789.eE"
+_LITERALS = {b"true": True, b"false": False, b"null": None}
+_ESCAPES = {34: 34, 92: 92, 47: 47, 98: 8, 102: 12, 110: 10, 114: 13, 116: 9}
+
+def _unescape(raw):
+    # raw is the string token without quotes, escapes validated by the tokenizer
+    if 92 not in raw:
+        return raw.decode()
+
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c != 92:
+            out.append(c)
+            i += 1
+            continue
+
+        c = raw[i+1]
+        if c == 117: # \uXXXX
+            code = int(raw[i+2:i+6], 16)
+            i += 6
+            if 0xd800 <= code < 0xdc00 and raw[i:i+2] == b"\\u":
+                # surrogate pair
+                low = int(raw[i+2:i+6], 16)
+                if 0xdc00 <= low < 0xe000:
+                    code = 0x10000 + ((code - 0xd800) << 10) + (low - 0xdc00)
+                    i += 6
+            out.extend(chr(code).encode())
+        else:
+            out.append(_ESCAPES[c])
+            i += 2
+
+    return out.decode()
+
+class JSONParser:
+    """Push parser building the decoded value as the body streams in.
+    Nesting deeper than max_depth and strings/numbers longer than max_token are rejected."""
+
+    def __init__(self, max_depth=8, max_token=256):
+        self._max_depth = max_depth
+        self._max_token = max_token
+        self._state = _VALUE
+        # open containers, innermost last, and the key waiting for its value per dict
+        self._stack = []
+        self._keys = []
+        self._tok = bytearray()
+        self._is_key = False
+        # in a string: 0 normal, 1 after \, >1 hex digits of \u left + 1
+        self._esc = 0
+        self._value = None
+
+    def _error(self, c, what):
+        raise ValueError("unexpected {} {}".format(repr(chr(c)) if c != None else "end", what))
+
+    def _add(self, value):
+        if not self._stack:
+            self._value = value
+        elif isinstance(self._stack[-1], list):
+            self._stack[-1].append(value)
+        else:
+            self._stack[-1][self._keys[-1]] = value
+
+    def _emit(self, value):
+        self._add(value)
+        self._state = _NEXT if self._stack else _DONE
+
+    def _open(self, container):
+        if len(self._stack) >= self._max_depth:
+            raise ValueError("nested deeper than {}".format(self._max_depth))
+
+        self._add(container)
+        self._stack.append(container)
+        self._keys.append(None)
+        self._state = _KEY_OR_END if isinstance(container, dict) else _VALUE_OR_END
+
+    def _close(self, c):
+        top = self._stack[-1]
+        if (c == 125) != isinstance(top, dict):
+            self._error(c, "closing bracket")
+
+        self._stack.pop()
+        self._keys.pop()
+        self._state = _NEXT if self._stack else _DONE
+
+    def _end_token(self):
+        tok = bytes(self._tok)
+        self._tok = bytearray()
+
+        if self._state == _NUMBER:
+            try:
+                if b"." in tok or b"e" in tok or b"E" in tok:
+                    value = float(tok)
+                else:
+                    value = int(tok)
+            except ValueError:
+                raise ValueError("bad number {}".format(tok.decode()))
+
+        else:
+            if tok not in _LITERALS:
+                raise ValueError("bad literal {}".format(tok.decode()))
+            value = _LITERALS[tok]
+
+        self._emit(value)
+
+    def _push(self, c):
+        if len(self._tok) >= self._max_token:
+            raise ValueError("token longer than {} bytes".format(self._max_token))
+        self._tok.append(c)
+
+    def feed(self, chunk):
+        for c in chunk:
+            state = self._state
+
+            if state == _STRING:
+                if self._esc == 0:
+                    if c == 34: # closing "
+                        value = _unescape(self._tok)
+                        self._tok = bytearray()
+                        if self._is_key:
+                            self._keys[-1] = value
+                            self._state = _COLON
+                        else:
+                            self._emit(value)
+                        continue
+
+                    if c < 32:
+                        self._error(c, "control character in string")
+                    if c == 92:
+                        self._esc = 1
+
+                elif self._esc == 1:
+                    if c == 117:
+                        self._esc = 5
+                    elif c in _ESCAPES:
+                        self._esc = 0
+                    else:
+                        self._error(c, "escape")
+
+                else:
+                    if c not in _HEX:
+                        self._error(c, "in \\u escape")
+                    self._esc -= 1
+                    if self._esc == 1:
+                        self._esc = 0
+
+                self._push(c)
+                continue
+
+            if state == _NUMBER or state == _LITERAL:
+                if (state == _NUMBER and c in _NUM) or (state == _LITERAL and 97 <= c <= 122):
+                    self._push(c)
+                    continue
+
+                self._end_token()
+                state = self._state
+                # c is handled below in the new state
+
+            if c in _WS:
+                continue
+
+            if state == _VALUE or state == _VALUE_OR_END:
+                if c == 93 and state == _VALUE_OR_END: # ]
+                    self._close(c)
+                elif c == 123: # {
+                    self._open({})
+                elif c == 91: # [
+                    self._open([])
+                elif c == 34:
+                    self._is_key = False
+                    self._state = _STRING
+                elif c in _NUM:
+                    self._state = _NUMBER
+                    self._push(c)
+                elif 97 <= c <= 122:
+                    self._state = _LITERAL
+                    self._push(c)
+                else:
+                    self._error(c, "expecting value")
+
+            elif state == _KEY or state == _KEY_OR_END:
+                if c == 125 and state == _KEY_OR_END: # }
+                    self._close(c)
+                elif c == 34:
+                    self._is_key = True
+                    self._state = _STRING
+                else:
+                    self._error(c, "expecting key")
+
+            elif state == _COLON:
+                if c != 58:
+                    self._error(c, "expecting :")
+                self._state = _VALUE
+
+            elif state == _NEXT:
+                if c == 44: # ,
+                    self._state = _KEY if isinstance(self._stack[-1], dict) else _VALUE
+                elif c == 125 or c == 93:
+                    self._close(c)
+                else:
+                    self._error(c, "expecting , or closing bracket")
+
+            else:
+                self._error(c, "after the end")
+
+    def finish(self):
+        if self._state == _NUMBER or self._state == _LITERAL:
+            self._end_token()
+
+        if self._state != _DONE:
+            self._error(None, "of body")
+
+        return self._value
@@ -0,0 +1,99 @@
+import uasyncio as asyncio
+from Metrics.Metrics import REGISTRY
+from WebServer.WebResponse import json_dump_stream
+
+class _Subscriber:
+    def __init__(self, size):
+        # encoded events waiting to be sent, oldest first
+        self.queue = []
+        self.size = size
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def put(self, data):
+        """Returns False if the oldest queued event had to be dropped."""
+        dropped = len(self.queue) >= self.size
+        if dropped:
+            # slow client, it gets the newest state
+            self.queue.pop(0)
+
+        self.queue.append(data)
+        self._ready.set()
+        return not dropped
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout):
+        """Next encoded event, b"" after timeout seconds without one, None when closed."""
+        if not self.queue and not self.closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return b""
+
+        if self.closed:
+            return None
+
+        return self.queue.pop(0) if self.queue else b""
+
+class EventHub:
+    """Broadcasts events to text/event-stream subscribers (see WebServer.events).
+
+    An event is encoded once on publish and queued for every subscriber. Each queue holds
+    at most queue_len events, the oldest is dropped when a subscriber can't keep up.
+    The last event of every name is kept and sent first to new subscribers (current state)."""
+
+    def __init__(self, max_subscribers=4, queue_len=4):
+        self.max_subscribers = max_subscribers
+        self._queue_len = queue_len
+        self._subscribers = []
+        # event name -> last encoded event
+        self._last = {}
+
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+        REGISTRY.gauge("sse_subscribers", fn=lambda: len(self._subscribers))
+        REGISTRY.counter("sse_events_total", fn=lambda: self.published)
+        REGISTRY.counter("sse_dropped_total", fn=lambda: self.dropped)
+        REGISTRY.counter("sse_rejected_total", fn=lambda: self.rejected)
+
+    def publish(self, event, data):
+        """data is anything json_dump_stream can encode."""
+        out = bytearray(b"event: ")
+        out += event.encode()
+        out += b"\ndata: "
+        for chunk in json_dump_stream(data):
+            out += chunk
+        out += b"\n\n"
+
+        self._last[event] = out
+        self.published += 1
+        for sub in self._subscribers:
+            if not sub.put(out):
+                self.dropped += 1
+
+    def subscribe(self):
+        """New subscriber with the current state queued, None if there are max_subscribers already."""
+        if len(self._subscribers) >= self.max_subscribers:
+            self.rejected += 1
+            return None
+
+        sub = _Subscriber(max(self._queue_len, len(self._last)))
+        for event in self._last:
+            sub.put(self._last[event])
+
+        self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        if sub in self._subscribers:
+            self._subscribers.remove(sub)
+
+    def close(self):
+        """Ends all current streams (i.e. when the server stops), new subscribers are still accepted."""
+        for sub in self._subscribers:
+            sub.close()
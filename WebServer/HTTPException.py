@@ -1,17 +1,25 @@
 OK = 200
+NOT_MODIFIED = 304
 BAD_REQUEST = 400
 NOT_FOUND = 404
 METHOD_NOT_ALLOWED = 405
+PAYLOAD_TOO_LARGE = 413
+REQUEST_HEADER_FIELDS_TOO_LARGE = 431
 INTERNAL_SERVER_ERROR = 500
 NOT_IMPLEMENTED = 501
+SERVICE_UNAVAILABLE = 503
 
 code_reason_map = {
     OK: "OK",
+    NOT_MODIFIED: "Not Modified",
     BAD_REQUEST: "Bad Request",
     NOT_FOUND: "Not Found",
     METHOD_NOT_ALLOWED: "Method Not Allowed",
+    PAYLOAD_TOO_LARGE: "Payload Too Large",
+    REQUEST_HEADER_FIELDS_TOO_LARGE: "Request Header Fields Too Large",
     INTERNAL_SERVER_ERROR: "Internal Server Error",
-    NOT_IMPLEMENTED: "Not Implemented"
+    NOT_IMPLEMENTED: "Not Implemented",
+    SERVICE_UNAVAILABLE: "Service Unavailable"
 }
 
 class HTTPException(Exception):
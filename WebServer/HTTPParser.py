@@ -0,0 +1,44 @@
+# Request line and header parsing done on raw bytes.
+# Nothing is decoded unless the server (or a route) is interested in it.
+
+# headers the server itself needs, routes can add more (see WebServer.route)
+DEFAULT_INTEREST = (b"accept", b"accept-encoding", b"connection", b"content-length", b"content-type", b"if-none-match",
+                    b"transfer-encoding")
+
+def _line_end(line):
+    # position of the line terminator (\r\n or \n)
+    end = len(line)
+    if end > 0 and line[end-1] == 10: end -= 1
+    if end > 0 and line[end-1] == 13: end -= 1
+    return end
+
+def parse_request_line(line):
+    """b"GET /path HTTP/1.1\\r\\n" -> ("GET", "/path", "HTTP/1.1"). Raises ValueError when malformed."""
+
+    end = _line_end(line)
+    sp1 = line.find(b" ", 0, end)
+    sp2 = line.find(b" ", sp1+1, end)
+    if sp1 <= 0 or sp2 <= sp1+1 or line.find(b" ", sp2+1, end) >= 0:
+        raise ValueError("expected three space separated parts")
+
+    if line[sp2+1:sp2+6] != b"HTTP/":
+        raise ValueError("bad protocol version")
+
+    return line[:sp1].decode(), line[sp1+1:sp2].decode(), line[sp2+1:end].decode()
+
+def parse_header(line, interest):
+    """b"Key: value\\r\\n" -> ("key", b"value") if key (lowercase bytes) is in interest, otherwise None.
+
+    Only the part up to the first colon is the key, so values can contain ": ".
+    Raises ValueError when malformed."""
+
+    colon = line.find(b":")
+    if colon <= 0:
+        raise ValueError("no header name")
+
+    key = line[:colon].lower()
+    if key not in interest:
+        return None
+
+    # value stays bytes, WebRequest decodes it on first access
+    return key.decode(), line[colon+1:_line_end(line)].strip()
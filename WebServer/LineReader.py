@@ -0,0 +1,63 @@
+class LineReader:
+    """Stream reader with a bounded readline().
+
+    Lines are assembled in a fixed buffer of size bytes with read(n), a longer line raises
+    ValueError once the buffer is full (uasyncio's readline() would keep the whole line in RAM).
+    Bytes read past a line are kept and returned first by the next readline() or read()."""
+
+    def __init__(self, reader, size):
+        self._reader = reader
+        self._buf = bytearray(size)
+        # unread bytes are self._buf[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        # bytes before this one (from self._start) are known to hold no b"\n"
+        self._scan = 0
+
+    def get_extra_info(self, name):
+        return self._reader.get_extra_info(name)
+
+    async def readline(self):
+        """Line including b"\\n", b"" at end of stream (an unterminated last line is returned as is)."""
+        buf = self._buf
+        while True:
+            # scanned by hand, MicroPython's bytearray has no find(), each byte is looked at once
+            i = max(self._scan, self._start)
+            while i < self._end and buf[i] != 10:
+                i += 1
+            self._scan = i
+
+            if i < self._end:
+                line = bytes(buf[self._start:i+1])
+                self._start = i + 1
+                return line
+
+            if self._start > 0:
+                # move the partial line to the front
+                n = self._end - self._start
+                buf[:n] = buf[self._start:self._end]
+                self._start = 0
+                self._end = n
+                self._scan = n
+
+            if self._end == len(self._buf):
+                raise ValueError("line longer than {} bytes".format(len(self._buf)))
+
+            data = await self._reader.read(len(self._buf) - self._end)
+            if data == b"":
+                line = bytes(buf[:self._end])
+                self._end = 0
+                self._scan = 0
+                return line
+
+            buf[self._end:self._end+len(data)] = data
+            self._end += len(data)
+
+    async def read(self, n):
+        """Up to n bytes, buffered ones first."""
+        if self._start < self._end:
+            data = bytes(self._buf[self._start:min(self._end, self._start + n)])
+            self._start += len(data)
+            return data
+
+        return await self._reader.read(n)
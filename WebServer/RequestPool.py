@@ -0,0 +1,39 @@
+from WebServer.WebRequest import WebRequest
+from WebServer.WebResponse import WebResponse
+
+class RequestPool:
+    """Fixed set of (WebRequest, WebResponse) pairs reused between requests instead of
+    allocating new ones for each. When all pairs are in use a new one is allocated
+    (counted in exhausted) and dropped after the request."""
+
+    def __init__(self, size):
+        self.size = size
+        self._free = []
+        for _ in range(size):
+            self._free.append((WebRequest(), WebResponse()))
+
+        self.exhausted = 0
+
+    def free(self):
+        return len(self._free)
+
+    def grow(self, n):
+        """Adds n pairs, i.e. for long-lived requests that hold theirs."""
+        self.size += n
+        for _ in range(n):
+            self._free.append((WebRequest(), WebResponse()))
+
+    def acquire(self):
+        if self._free:
+            return self._free.pop()
+
+        self.exhausted += 1
+        return (WebRequest(), WebResponse())
+
+    def release(self, pair):
+        # drop references to request data right away, not on the next acquire
+        pair[0].reset()
+        pair[1].reset()
+
+        if len(self._free) < self.size:
+            self._free.append(pair)
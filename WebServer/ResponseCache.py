@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+# approximate per-entry cost of the tuple and dict slot
+ENTRY_OVERHEAD = 64
+
+class ResponseCache:
+    """LRU cache of responses, stored as (response head, body) bytes under a byte budget.
+
+    Used for small static files and for routes added with cache= (see WebServer.route). Entries
+    can expire after a ttl or be dropped together by tag with invalidate_tag()."""
+
+    def __init__(self, budget, max_entry=None):
+        self.budget = budget
+        self.max_entry = max_entry if max_entry != None else budget // 4
+        self.used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # key -> (head, body, tags, expiry in ticks_ms or None), oldest first
+        self._entries = OrderedDict()
+
+    def _cost(self, key, head, body):
+        return len(key) + len(head) + len(body) + ENTRY_OVERHEAD
+
+    def get(self, key):
+        """(head, body) or None."""
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        head, body, tags, expires = entry
+        if expires != None and time.ticks_diff(expires, time.ticks_ms()) <= 0:
+            self.used -= self._cost(key, head, body)
+            self.misses += 1
+            return None
+
+        # reinsert as most recently used
+        self._entries[key] = entry
+        self.hits += 1
+        return head, body
+
+    def fits(self, key, head, size):
+        """Whether head and a body of given size are small enough to be cached (put() won't refuse them)."""
+        return len(key) + len(head) + size + ENTRY_OVERHEAD <= self.max_entry
+
+    def put(self, key, head, body, ttl=0, tags=()):
+        """ttl in seconds, 0 keeps the entry until it's invalidated (or evicted)."""
+        cost = self._cost(key, head, body)
+        if cost > self.max_entry:
+            return False
+
+        self.invalidate(key)
+        while self.used + cost > self.budget:
+            oldest = next(iter(self._entries))
+            self.invalidate(oldest)
+            self.evictions += 1
+
+        expires = time.ticks_add(time.ticks_ms(), ttl * 1000) if ttl > 0 else None
+        self._entries[key] = (head, body, tags, expires)
+        self.used += cost
+        return True
+
+    def invalidate(self, key):
+        try:
+            head, body, _, _ = self._entries.pop(key)
+        except KeyError:
+            return
+
+        self.used -= self._cost(key, head, body)
+
+    def invalidate_tag(self, tag):
+        stale = [key for key in self._entries if tag in self._entries[key][2]]
+        for key in stale:
+            self.invalidate(key)
+
+        self.invalidations += len(stale)
+
+    def clear(self):
+        self._entries.clear()
+        self.used = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "used": self.used,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,107 @@
+# Routes are compiled into:
+#  - a dict of exact urls (no parameters), resolved with a single lookup,
+#  - a segment trie for urls with parameters, i.e. /sensor/<id>.
+
+class _Node:
+    def __init__(self):
+        # segment -> _Node
+        self.children = {}
+        # parameter child, matches any single segment
+        self.param_name = None
+        self.param = None
+        # method -> handler, empty for intermediate nodes
+        self.handlers = {}
+
+def _segments(url):
+    return url[1:].split("/") if url.startswith("/") else url.split("/")
+
+def _is_param(segment):
+    return len(segment) > 2 and segment[0] == "<" and segment[-1] == ">"
+
+class Router:
+    def __init__(self):
+        self._exact = {}
+        self._root = _Node()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, url, method, func):
+        segments = _segments(url)
+
+        has_params = False
+        for segment in segments:
+            if _is_param(segment):
+                has_params = True
+                break
+
+        if not has_params:
+            if url not in self._exact:
+                self._exact[url] = {}
+                self._count += 1
+
+            self._exact[url][method] = func
+            return
+
+        node = self._root
+        for segment in segments:
+            if _is_param(segment):
+                name = segment[1:-1]
+                if node.param == None:
+                    node.param = _Node()
+                    node.param_name = name
+                elif node.param_name != name:
+                    raise ValueError("conflicting parameter names <{}> and <{}> in {}".format(node.param_name, name, url))
+
+                node = node.param
+
+            else:
+                if segment not in node.children:
+                    node.children[segment] = _Node()
+
+                node = node.children[segment]
+
+        if len(node.handlers) == 0:
+            self._count += 1
+
+        node.handlers[method] = func
+
+    def resolve(self, path):
+        """Returns (method -> handler dict, parameters dict) or None if nothing matches."""
+
+        handlers = self._exact.get(path)
+        if handlers != None:
+            return handlers, None
+
+        if self._root.param == None and len(self._root.children) == 0:
+            # no parametrized routes
+            return None
+
+        params = {}
+        node = self._match(self._root, _segments(path), 0, params)
+        if node == None:
+            return None
+
+        return node.handlers, params
+
+    def _match(self, node, segments, i, params):
+        if i == len(segments):
+            return node if len(node.handlers) > 0 else None
+
+        segment = segments[i]
+
+        # static segments take precedence over parameters
+        child = node.children.get(segment)
+        if child != None:
+            found = self._match(child, segments, i+1, params)
+            if found != None:
+                return found
+
+        if node.param != None and segment != "":
+            found = self._match(node.param, segments, i+1, params)
+            if found != None:
+                params[node.param_name] = segment
+                return found
+
+        return None
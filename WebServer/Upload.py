@@ -0,0 +1,80 @@
+import binascii
+import gc
+import hashlib
+import os
+import time
+import uasyncio as asyncio
+from Metrics.Metrics import REGISTRY
+
+_upload_bytes = REGISTRY.counter("http_upload_bytes_total")
+_upload_kbps = REGISTRY.gauge("http_upload_last_kbps")
+_upload_heap = REGISTRY.gauge("http_upload_last_min_free_heap_bytes")
+
+class Upload:
+    """Body of a request to an upload route, left unread by the server.
+    The route decides where it goes and calls save()."""
+
+    def __init__(self, reader, length, chunk, timeout):
+        self.length = length
+        self.remaining = length
+        self._reader = reader
+        self._chunk = chunk
+        # seconds for the whole body, a slow client can't hold its slot longer
+        self._timeout = timeout
+
+        # filled by save()
+        self.digest = None
+        self.ms = None
+        self.kbps = None
+        self.min_free = None
+
+    async def save(self, path, sha256=None):
+        """Streams the body to path.tmp, hashing it on the way, then renames it over path.
+
+        sha256 is the expected hex digest (i.e. from a request header), on mismatch
+        the old file stays and ValueError is raised. Returns the hex digest."""
+
+        tmp = path + ".tmp"
+        h = hashlib.sha256()
+        start = time.ticks_ms()
+        self.min_free = gc.mem_free()
+
+        try:
+            with open(tmp, "wb") as f:
+                await asyncio.wait_for(self._write(f, h), self._timeout)
+
+            self.digest = binascii.hexlify(h.digest()).decode()
+            if sha256 != None and sha256.lower() != self.digest:
+                raise ValueError("sha256 mismatch, got {}".format(self.digest))
+
+            os.rename(tmp, path)
+
+        except Exception:
+            # partial or unverified file never replaces the old one
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        self.ms = max(1, time.ticks_diff(time.ticks_ms(), start))
+        self.kbps = self.length * 1000 // 1024 // self.ms
+
+        _upload_bytes.inc(self.length)
+        _upload_kbps.set(self.kbps)
+        _upload_heap.set(self.min_free)
+        return self.digest
+
+    async def _write(self, f, h):
+        while self.remaining > 0:
+            data = await self._reader.read(min(self.remaining, self._chunk))
+            if data == b"":
+                raise EOFError("upload cut short")
+
+            self.remaining -= len(data)
+            h.update(data)
+            f.write(data)
+            self.min_free = min(self.min_free, gc.mem_free())
+
+    def stats(self):
+        return {"bytes": self.length, "ms": self.ms, "kbps": self.kbps, "min_free_heap": self.min_free}
@@ -1,10 +1,22 @@
 class WebRequest:
-    def __init__(self, method):
-        self.method = method
-        self.path = None
+    # fixed attribute set, objects are pooled and reset() between requests (see RequestPool)
+    __slots__ = ("method", "version", "path", "_headers", "_urldata", "_data", "_params", "_upload")
+
+    def __init__(self, method=None, version="HTTP/1.0"):
         self._headers = {}
         self._urldata = {}
         self._data = {}
+        self.reset(method, version)
+
+    def reset(self, method=None, version="HTTP/1.0"):
+        self.method = method
+        self.version = version
+        self.path = None
+        self._headers.clear()
+        self._urldata.clear()
+        self._data.clear()
+        self._params = None
+        self._upload = None
 
     def is_get(self):
         return self.method == "GET"
@@ -19,7 +31,34 @@ class WebRequest:
         return key in self._headers
 
     def get_header(self, key):
-        return self._headers[key]
+        value = self._headers[key]
+        if isinstance(value, bytes):
+            # headers are stored raw by the parser, decoded on first access
+            value = value.decode()
+            self._headers[key] = value
+
+        return value
+
+    def wants_keep_alive(self):
+        # HTTP/1.1 is persistent by default, HTTP/1.0 only when asked for
+        conn = self.get_header("connection").lower() if self.has_header("connection") else ""
+        if self.version == "HTTP/1.1":
+            return "close" not in conn
+
+        return "keep-alive" in conn
+
+    def accepts_encoding(self, encoding):
+        try:
+            accept = self.get_header("accept-encoding")
+        except KeyError:
+            return False
+
+        for entry in accept.split(","):
+            # remove quality factor
+            if entry.split(";")[0].strip() == encoding:
+                return True
+
+        return False
 
     def parse_url(self, url):
         url_split = url.split("?")
@@ -46,4 +85,24 @@ class WebRequest:
         return key in self._data
 
     def get_data(self, key):
-        return self._data[key]
\ No newline at end of file
+        return self._data[key]
+
+    def set_params(self, params):
+        """Path parameters matched by the router (dict or None)."""
+        self._params = params
+
+    def has_param(self, key):
+        return self._params != None and key in self._params
+
+    def get_param(self, key):
+        if self._params == None:
+            raise KeyError(key)
+
+        return self._params[key]
+
+    def set_upload(self, upload):
+        self._upload = upload
+
+    def get_upload(self):
+        """Upload of an upload route, None if the request has no body."""
+        return self._upload
\ No newline at end of file
@@ -1,66 +1,169 @@
-from WebServer.HTTPException import HTTPException, OK, BAD_REQUEST, INTERNAL_SERVER_ERROR, code_reason_map
+from Metrics.Metrics import REGISTRY
+from WebServer.HTTPException import HTTPException, OK, NOT_MODIFIED, BAD_REQUEST, INTERNAL_SERVER_ERROR, code_reason_map
 
 _FILE_BUF = bytearray(64)
 
-async def json_dump_stream(obj, write):
-    if obj is None:
-        await write("null")
+_static_bytes = REGISTRY.counter("http_static_bytes_total")
+
+# response heads are assembled from pre-encoded pieces
+_STATUS_LINES = {}
+for _code in code_reason_map:
+    _STATUS_LINES[_code] = "HTTP/1.1 {} {}\r\n".format(_code, code_reason_map[_code]).encode()
+
+# content-type header lines of the common types
+_CONTENT_TYPES = {}
+for _type in ("application/json", "text/html", "text/css", "text/plain"):
+    _CONTENT_TYPES[_type] = "content-type: {}\r\n".format(_type).encode()
+
+# connection headers and the empty line ending the head, keep-alive ones per timeout
+_CONNECTION_CLOSE = b"connection: close\r\n\r\n"
+_connection_keep_alive = {None: b"connection: keep-alive\r\n\r\n"}
+
+# shared by all responses, a chunk is always written out before the buffer is refilled
+_JSON_BUF = bytearray(128)
+
+_JSON_ESCAPES = {
+    0x22: b'\\"',
+    0x5c: b'\\\\',
+    0x08: b'\\b',
+    0x0c: b'\\f',
+    0x0a: b'\\n',
+    0x0d: b'\\r',
+    0x09: b'\\t'
+}
+
+_HEX = b"0123456789abcdef"
+
+class _JSONChunker:
+    def __init__(self, buf):
+        self._buf = buf
+        self._mv = memoryview(buf)
+        self._size = len(buf)
+        self._pos = 0
+
+    def chunks(self, obj):
+        yield from self._dump(obj)
+        if self._pos > 0:
+            yield self._mv[:self._pos]
+
+    def _put(self, data):
+        # copies data into the buffer, yielding the buffer every time it gets full
+        start = 0
+        left = len(data)
+        while left > 0:
+            n = min(left, self._size - self._pos)
+            self._mv[self._pos:self._pos+n] = data[start:start+n]
+            self._pos += n
+            start += n
+            left -= n
+
+            if self._pos == self._size:
+                yield self._mv
+                self._pos = 0
+
+    def _put_string(self, data, latin1):
+        # data is utf-8 (latin1=False) or single byte characters (latin1=True)
+        yield from self._put(b'"')
+
+        mv = memoryview(data)
+        start = 0
+        for i, x in enumerate(data):
+            if x >= 0x20 and x != 0x22 and x != 0x5c and (x < 0x80 or not latin1):
+                continue
+
+            yield from self._put(mv[start:i])
+            start = i+1
+
+            if x in _JSON_ESCAPES:
+                yield from self._put(_JSON_ESCAPES[x])
+            else:
+                yield from self._put(b"\\u00")
+                yield from self._put(_HEX[x >> 4:(x >> 4)+1])
+                yield from self._put(_HEX[x & 0xf:(x & 0xf)+1])
+
+        yield from self._put(mv[start:])
+        yield from self._put(b'"')
+
+    def _dump(self, obj):
+        if obj is None:
+            yield from self._put(b"null")
 
-    elif isinstance(obj, str):
-        await write('"')
-        await write(obj)
-        await write('"')
+        elif isinstance(obj, str):
+            yield from self._put_string(obj.encode(), False)
+
+        elif isinstance(obj, bool):
+            if obj:
+                yield from self._put(b"true")
+            else:
+                yield from self._put(b"false")
+
+        elif isinstance(obj, int) or isinstance(obj, float):
+            yield from self._put(str(obj).encode())
+
+        elif isinstance(obj, bytes):
+            # treating bytes as single byte characters (as chr() would)
+            yield from self._put_string(obj, True)
+
+        elif isinstance(obj, dict):
+            yield from self._put(b"{")
+            for i, key in enumerate(obj):
+                if i > 0: yield from self._put(b",")
+                yield from self._put_string(key.encode(), False)
+                yield from self._put(b":")
+                yield from self._dump(obj[key])
+            yield from self._put(b"}")
+
+        elif isinstance(obj, list) or isinstance(obj, tuple):
+            yield from self._put(b"[")
+            for i, entry in enumerate(obj):
+                if i > 0: yield from self._put(b",")
+                yield from self._dump(entry)
+            yield from self._put(b"]")
 
-    elif isinstance(obj, bool):
-        if obj:
-            await write('true')
         else:
-            await write('false')
-
-    elif isinstance(obj, int) or isinstance(obj, float):
-        await write(str(obj))
-
-    elif isinstance(obj, bytes):
-        # treating bytes as ascii string
-        await write('"')
-        for x in obj: await write(chr(x))
-        await write('"')
-
-    elif isinstance(obj, dict):
-        await write('{')
-        for i, key in enumerate(obj):
-            await write('"')
-            await write(key)
-            await write('":')
-            await json_dump_stream(obj[key], write)
-            if i < len(obj)-1: await write(',')
-        await write('}')
-
-    elif isinstance(obj, list) or isinstance(obj, tuple):
-        await write('[')
-        for i, entry in enumerate(obj):
-            await json_dump_stream(entry, write)
-            if i < len(obj)-1: await write(',')
-        await write(']')
-
-    else:
-        raise ValueError("unsupported value {}".format(type(obj)))
+            raise ValueError("unsupported value {}".format(type(obj)))
+
+def json_dump_stream(obj, buf=_JSON_BUF):
+    """Yields obj serialized to JSON in chunks of at most len(buf) bytes.
+
+    Every chunk is a view of buf, it must be consumed before requesting the next one.
+    Raises ValueError on unsupported types (possibly after some chunks were yielded)."""
+
+    return _JSONChunker(buf).chunks(obj)
 
 class WebResponse:
+    # fixed attribute set, objects are pooled and reset() between requests (see RequestPool)
+    __slots__ = ("_code", "_headers", "_body", "_stream", "isSent", "keep_alive", "keep_alive_timeout",
+                 "_req", "_logger", "_writer")
+
     def __init__(self):
-        self._code = OK
         self._headers = {}
+        self.reset()
+
+    def reset(self):
+        self._code = OK
+        self._headers.clear()
         self._body = None
-        self.send = None
+        self._stream = None
         self.isSent = False
+        self.keep_alive = False
+        self.keep_alive_timeout = None
+        # set by bind(), used by send()
+        self._req = None
+        self._logger = None
+        self._writer = None
 
     def code(self, code):
         """Do not call directly, raise HTTPException."""
         self._code = code
 
+    def get_code(self):
+        return self._code
+
     def clear(self):
         self._headers.clear()
         self._body = None
+        self._stream = None
 
     def header(self, key, value):
         self._headers[key] = value
@@ -75,45 +178,123 @@ class WebResponse:
             else:
                 raise ValueError("Attempted to append to non-string body")
 
+    def stream(self, chunks):
+        """Body produced while sending, chunks is an iterable of str/bytes.
+
+        Sent with chunked transfer encoding (connection closed instead for HTTP/1.0 clients),
+        so the length doesn't need to be known up front."""
+        self._stream = chunks
+
     def body_should_stringify(self):
         return isinstance(self._body, dict) or isinstance(self._body, list) or isinstance(self._body, tuple)
 
-    def define_send(self, send):
-        self.send = send
+    def accepts_json(self, req):
+        """None if the client sent no Accept header."""
+        try:
+            accept = req.get_header("accept")  # raises KeyError
+        except KeyError:
+            return None
+
+        accept = accept.split(",")
+        accept = [x.split(";")[0].strip() for x in accept] # remove quality factor
+        return "application/json" in accept or "*/*" in accept
+
+    def check_accepts_json(self, req):
+        """Raises HTTPException if the client can't take a stringified (JSON) body."""
+        accepts = self.accepts_json(req)
+        if accepts == None:
+            raise HTTPException(BAD_REQUEST, "Client did not sent Accept header (required for stringified data).")
+
+        if not accepts:
+            raise HTTPException(BAD_REQUEST, "Client does not accept stringified data (accept={}).".format(req.get_header("accept")))
+
+    def serialize(self, req):
+        """(head without connection headers, body) as bytes, for ResponseCache.
+        None for streamed responses and ones without a body."""
+        if self._stream != None or self._body == None:
+            return None
+
+        if self.body_should_stringify():
+            self.check_accepts_json(req)
+            self.header("content-type", "application/json")
+
+            body = bytearray()
+            try:
+                for chunk in json_dump_stream(self._body):
+                    body += chunk
+            except ValueError as e:
+                raise HTTPException(INTERNAL_SERVER_ERROR, "JSON stringify error: {}.".format(e))
+
+        elif isinstance(self._body, str):
+            body = self._body.encode()
+
+        else:
+            return None
+
+        return bytes(self.head(len(body))), bytes(body)
+
+    async def write_cached(self, writer, head, body):
+        """Response from a cache (head without connection headers, body), in one write."""
+        out = bytearray(head)
+        out += self.connection_head()
+        out += body
+        writer.write(out)
+        await writer.drain()
+        self.isSent = True
+
+    def bind(self, req, logger, writer):
+        """Connection the response goes to, done by the server before calling the route."""
+        self._req = req
+        self._logger = logger
+        self._writer = writer
+
+    async def send(self):
+        """Sends the response now (i.e. before a long running action in the route)."""
+        await self.send_internal(self._req, self._logger, self._writer)
 
     async def send_internal(self, req, logger, writer):
         # req is None when exception happens before request is fully received
-        if req != None and self.body_should_stringify():
+        if self._stream != None:
+            await self._send_stream(req, writer)
+            logger.trace("body sent as stream.")
+
+        elif req != None and self.body_should_stringify():
+            self.check_accepts_json(req)
+            self.header("content-type", "application/json")
+
+            # dry run to get Content-Length without buffering the body,
+            # a body that fits in one chunk (i.e. status reports) is kept and not encoded again
+            length = 0
+            single = None
             try:
-                accept = req.get_header("accept")  # raises KeyError
-            except KeyError:
-                raise HTTPException(BAD_REQUEST, "Client did not sent Accept header (required for stringified data).")
-
-            accept = accept.split(",")
-            accept = [x.split(";")[0] for x in accept] # remove quality factor
-            if "application/json" in accept or "*/*" in accept:
-                self.header("content-type", "application/json")
-                await self.write_headers(writer)
-
-                # used in json_dump_stream
-                async def stream_write(s):
-                    writer.write(s)
-                    await writer.drain()
-
-                try:
-                    await json_dump_stream(self._body, stream_write)
-                except ValueError as e:
-                    raise HTTPException(INTERNAL_SERVER_ERROR, "JSON stringify error: {}.".format(e))
-
+                for chunk in json_dump_stream(self._body):
+                    single = bytes(chunk) if length == 0 else None
+                    length += len(chunk)
+            except ValueError as e:
+                raise HTTPException(INTERNAL_SERVER_ERROR, "JSON stringify error: {}.".format(e))
+
+            if single != None:
+                await self.write_headers(writer, length, single)
+                self.isSent = True
                 logger.trace("body sent as json.")
+                return
 
-            else:
-                raise HTTPException(BAD_REQUEST, "Client does not accept stringified data (accept={}).".format(accept))
+            # head goes out with the first chunk
+            out = self.full_head(length)
+            for chunk in json_dump_stream(self._body):
+                if out != None:
+                    out += chunk
+                    chunk = out
+                    out = None
+
+                writer.write(chunk)
+                await writer.drain()
+
+            logger.trace("body sent as json.")
 
         elif isinstance(self._body, str):
-            await self.write_headers(writer)
-            writer.write(self._body)
-            await writer.drain()
+            body = self._body.encode()
+            await self.write_headers(writer, len(body), body)
             logger.trace("body sent as string.")
 
         elif self._body == None:
@@ -122,20 +303,143 @@ class WebResponse:
         else:
             raise HTTPException(INTERNAL_SERVER_ERROR, "Can't stringify body(type={}) on {} {}.".format(type(self._body), req.method, req.path))
 
-        await writer.wait_closed()
         self.isSent = True
 
-    async def write_headers(self, writer):
-        writer.write("HTTP/1.1 {} {}\r\n".format(self._code, code_reason_map[self._code]))
+    async def _send_stream(self, req, writer):
+        chunked = req != None and req.version == "HTTP/1.1"
+        if chunked:
+            self.header("transfer-encoding", "chunked")
+        else:
+            # end of body is marked by closing the connection
+            self.keep_alive = False
+
+        # head goes out with the first chunk
+        out = self.full_head(None)
+        for chunk in self._stream:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+
+            if len(chunk) == 0:
+                # empty chunk would end the body
+                continue
+
+            if chunked:
+                out += "{:x}\r\n".format(len(chunk)).encode()
+                out += chunk
+                out += b"\r\n"
+            else:
+                out += chunk
+
+            writer.write(out)
+            await writer.drain()
+            out = bytearray()
+
+        if chunked:
+            out += b"0\r\n\r\n"
+
+        if len(out) > 0:
+            writer.write(out)
+            await writer.drain()
+
+    def head(self, length):
+        """Status line and headers except the connection ones (those depend on the request), as bytearray."""
+        out = bytearray(_STATUS_LINES[self._code])
         for key in self._headers:
-            writer.write("{}: {}\r\n".format(key, self._headers[key]))
+            value = self._headers[key]
+            if key == "content-type" and value in _CONTENT_TYPES:
+                out += _CONTENT_TYPES[value]
+            else:
+                out += "{}: {}\r\n".format(key, value).encode()
+
+        # framing, required for persistent connections
+        # None for responses that never have a body (304) and streamed ones
+        if length != None:
+            out += "content-length: {}\r\n".format(length).encode()
+
+        return out
+
+    def connection_head(self):
+        """Connection headers and the empty line ending the head."""
+        if not self.keep_alive:
+            return _CONNECTION_CLOSE
+
+        block = _connection_keep_alive.get(self.keep_alive_timeout)
+        if block == None:
+            block = "connection: keep-alive\r\nkeep-alive: timeout={}\r\n\r\n".format(self.keep_alive_timeout).encode()
+            _connection_keep_alive[self.keep_alive_timeout] = block
+
+        return block
+
+    def full_head(self, length):
+        out = self.head(length)
+        out += self.connection_head()
+        return out
 
-        writer.write("\r\n")
+    async def send_head(self):
+        """Sends only the head (no content-length), the route then writes the body with write().
+        The connection is closed after the response."""
+        self.keep_alive = False
+        await self.write_headers(self._writer, None)
+        self.isSent = True
+
+    async def write(self, data):
+        """Raw body data after send_head()."""
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def write_headers(self, writer, length, body=None):
+        """Head, and body if given, in one write."""
+        out = self.full_head(length)
+        if body != None:
+            out += body
+
+        writer.write(out)
         await writer.drain()
 
-    async def send_file(self, file, writer):
-        f = open(file, "rb")
+    async def send_file(self, file, writer, req=None, etag=None, gzip=False, max_age=0, cache=None, buf=_FILE_BUF):
+        """Sends a static file.
+
+        etag comes from the static manifest, when the request's If-None-Match matches it
+        304 is sent instead of the file. gzip=True sends precompressed file+".gz" variant.
+        cache is an optional ResponseCache, files not in it are streamed in len(buf) chunks."""
+
+        if etag != None:
+            self.header("etag", etag)
+            if max_age > 0:
+                self.header("cache-control", "max-age={}".format(max_age))
+            else:
+                # always revalidate, answered with 304 without touching the file
+                self.header("cache-control", "no-cache")
+
+            if req != None and req.has_header("if-none-match"):
+                match = req.get_header("if-none-match")
+                if match == "*" or etag in match:
+                    self.code(NOT_MODIFIED)
+                    await self.write_headers(writer, None)
+                    self.isSent = True
+                    return
+
+        if gzip:
+            self.header("content-encoding", "gzip")
+            key = file + ".gz"
+        else:
+            key = file
+
+        if cache != None:
+            entry = cache.get(key)
+            if entry != None:
+                head, body = entry
+                await self.write_cached(writer, head, body)
+                _static_bytes.inc(len(body))
+                return
 
+        f = open(key, "rb")
+        try:
+            await self._send_file(file, f, writer, key, cache, buf)
+        finally:
+            f.close()
+
+    async def _send_file(self, file, f, writer, key, cache, buf):
         ext_map = {
             "txt": "text/plain",
             "html": "text/html",
@@ -149,18 +453,42 @@ class WebResponse:
         except KeyError:
             raise HTTPException(INTERNAL_SERVER_ERROR, "Unsupported file extension type.")
 
-        await self.write_headers(writer)
+        # seek to end gives the size of the opened variant
+        size = f.seek(0, 2)
+        f.seek(0)
+
+        head = self.head(size)
+        if cache != None and cache.fits(key, head, size):
+            body = f.read()
+            cache.put(key, bytes(head), body)
+
+            await self.write_cached(writer, head, body)
+            _static_bytes.inc(size)
+            return
+
+        # head goes out with the first block
+        out = head
+        out += self.connection_head()
 
-        mv = memoryview(_FILE_BUF)
+        mv = memoryview(buf)
         while True:
-            read = f.readinto(_FILE_BUF)
+            read = f.readinto(buf)
             if read == 0:
                 break
 
-            writer.write(mv[:read])
+            if out != None:
+                out += mv[:read]
+                writer.write(out)
+                out = None
+            else:
+                writer.write(mv[:read])
+
             await writer.drain()
+            _static_bytes.inc(read)
 
-        await writer.wait_closed()
-        self.isSent = True
+        if out != None:
+            # empty file
+            writer.write(out)
+            await writer.drain()
 
-        f.close()
\ No newline at end of file
+        self.isSent = True
\ No newline at end of file
@@ -1,8 +1,18 @@
 import Logger.Logger as Logger
 import uasyncio as asyncio
-from WebServer.HTTPException import HTTPException, BAD_REQUEST, NOT_FOUND, METHOD_NOT_ALLOWED, INTERNAL_SERVER_ERROR, NOT_IMPLEMENTED
-from WebServer.WebRequest import WebRequest
-from WebServer.WebResponse import WebResponse
+import config_parser
+import gc
+import os
+import time
+from WebServer.HTTPException import HTTPException, BAD_REQUEST, NOT_FOUND, METHOD_NOT_ALLOWED, PAYLOAD_TOO_LARGE, REQUEST_HEADER_FIELDS_TOO_LARGE, INTERNAL_SERVER_ERROR, NOT_IMPLEMENTED, SERVICE_UNAVAILABLE, code_reason_map
+from WebServer.BodyParser import FormParser, JSONParser
+from WebServer.HTTPParser import DEFAULT_INTEREST, parse_request_line, parse_header, _line_end
+from WebServer.LineReader import LineReader
+from WebServer.RequestPool import RequestPool
+from WebServer.Upload import Upload
+from WebServer.ResponseCache import ResponseCache
+from WebServer.Router import Router
+from Metrics.Metrics import REGISTRY
 
 SUPPORTED_METHODS = ("GET", "POST")
 
@@ -13,45 +23,339 @@ def gen_status_report(status, message):
     }
 
 class WebServer:
-    def __init__(self, loglevel=Logger.INFO, static="/static"):
+    def __init__(self, loglevel=Logger.INFO, static="/static", keepalive=True, keepalive_timeout=5, static_max_age=0,
+                 static_cache=0, file_chunk=512, max_headers=24, max_header_size=512,
+                 api_prefixes=(), max_inflight=4, mem_watermark=0, retry_after=1,
+                 line_timeout=5, header_timeout=5, body_timeout=10, max_header_bytes=2048,
+                 max_body=2048, max_body_depth=8, max_body_token=256, body_chunk=128, pool_size=None,
+                 response_cache=0, static_cache_entry=None, response_cache_entry=None, upload_timeout=30):
         self.logger = Logger.Logger("websrv", loglevel=loglevel)
         self.srv = None
-        self.routes = {}
+        self.router = Router()
         self._static_folder = static
+        # paths under these prefixes are never looked up in the static folder
+        self._api_prefixes = tuple(api_prefixes)
+        # relative paths of files in the static folder, built on start
+        self._static_index = set()
+        self._keepalive = keepalive
+        # seconds an idle persistent connection is held open waiting for the next request
+        self._keepalive_timeout = keepalive_timeout
+        # path -> content hash, written by build_static.py next to the static folder
+        self._static_manifest = {}
+        self._static_max_age = static_max_age
+        # in-RAM cache of small static files, static_cache is the byte budget (0 disables),
+        # static_cache_entry the largest file (head included) kept, a quarter of the budget by default
+        self.static_cache = ResponseCache(static_cache, static_cache_entry) if static_cache > 0 else None
+        # serialized responses of routes added with cache=, response_cache is the byte budget (0 disables),
+        # response_cache_entry the largest response kept, half of the budget by default
+        if response_cache_entry == None:
+            response_cache_entry = response_cache // 2
+        self.response_cache = ResponseCache(response_cache, response_cache_entry) if response_cache > 0 else None
+        # read buffer for files streamed from flash, shared by all connections
+        self._file_buf = bytearray(file_chunk)
+        # request header limits, count, single line length and all lines together
+        self._max_headers = max_headers
+        self._max_header_size = max_header_size
+        self._max_header_bytes = max_header_bytes
+        # deadlines (seconds) for the first request line, all headers and the body,
+        # slow clients are disconnected without a response
+        self._line_timeout = line_timeout
+        self._header_timeout = header_timeout
+        self._body_timeout = body_timeout
+        # deadline (seconds) for a whole upload route body
+        self._upload_timeout = upload_timeout
+        self.timed_out = 0
+        # request bodies are parsed as they arrive, larger ones are rejected before reading,
+        # depth (JSON nesting) and token (single string/number) limits bound the parser's memory
+        self._max_body = max_body
+        self._max_body_depth = max_body_depth
+        self._max_body_token = max_body_token
+        self._body_chunk = body_chunk
+        # lowercase header names that are kept, others are skipped without decoding
+        self._header_interest = set(DEFAULT_INTEREST)
+
+        # admission control, requests over max_inflight are shed with a precomputed 503
+        self._max_inflight = max_inflight
+        self._inflight = 0
+        # bytes of free heap that must remain after a request body is read (0 disables the check)
+        self._mem_watermark = mem_watermark
+        self._shed_response = "HTTP/1.1 {} {}\r\nretry-after: {}\r\ncontent-length: 0\r\nconnection: close\r\n\r\n".format(
+            SERVICE_UNAVAILABLE, code_reason_map[SERVICE_UNAVAILABLE], retry_after).encode()
+
+        # request/response objects, one pair per request in flight
+        self._pool = RequestPool(pool_size if pool_size != None else max_inflight)
+
+        self.accepted = 0
+        self.shed = 0
+        self.shed_memory = 0
+
+        # metrics, handling time per route (func -> Histogram) and response count per status
+        self._route_timing = {}
+        # upload route func -> max body size
+        self._upload_routes = {}
+        # cached route func -> (ttl, tags)
+        self._cached_routes = {}
+        # cached routes with stringified (JSON) bodies, cache hits check Accept for them
+        self._json_routes = set()
+        # EventHubs of event stream routes
+        self._hubs = []
+        self._static_timing = REGISTRY.histogram("http_request_duration_ms", {"route": "static"})
+        self._other_timing = REGISTRY.histogram("http_request_duration_ms", {"route": "none"})
+        self._status_count = {}
+        for code in code_reason_map:
+            self._status_count[code] = REGISTRY.counter("http_responses_total", {"code": code})
+
+        REGISTRY.counter("http_accepted_total", fn=lambda: self.accepted)
+        REGISTRY.counter("http_shed_total", fn=lambda: self.shed)
+        REGISTRY.counter("http_shed_memory_total", fn=lambda: self.shed_memory)
+        REGISTRY.counter("http_timed_out_total", fn=lambda: self.timed_out)
+        REGISTRY.counter("http_pool_exhausted_total", fn=lambda: self._pool.exhausted)
+        REGISTRY.gauge("http_pool_free", fn=self._pool.free)
+        if self.static_cache != None:
+            REGISTRY.counter("http_static_cache_hits_total", fn=lambda: self.static_cache.hits)
+            REGISTRY.counter("http_static_cache_misses_total", fn=lambda: self.static_cache.misses)
+        if self.response_cache != None:
+            REGISTRY.counter("http_response_cache_hits_total", fn=lambda: self.response_cache.hits)
+            REGISTRY.counter("http_response_cache_misses_total", fn=lambda: self.response_cache.misses)
+            REGISTRY.counter("http_response_cache_evictions_total", fn=lambda: self.response_cache.evictions)
+            REGISTRY.counter("http_response_cache_invalidations_total", fn=lambda: self.response_cache.invalidations)
+            REGISTRY.gauge("http_response_cache_bytes", fn=lambda: self.response_cache.used)
+
+    def load_static_manifest(self):
+        self._static_manifest = {}
+        if self.static_cache != None:
+            # cached heads carry ETags from the old manifest
+            self.static_cache.clear()
+
+        if self._static_folder == None:
+            return
+
+        try:
+            self._static_manifest = config_parser.read_dict(self._static_folder + ".manifest")
+            self.logger.debug("static manifest loaded, {} entries.", len(self._static_manifest))
+        except (OSError, ValueError):
+            # no manifest (or broken one), files are served without ETag and compression
+            self.logger.debug("no static manifest.")
+
+    def index_static_folder(self):
+        self._static_index = set()
+        if self._static_folder == None:
+            return
+
+        try:
+            self._index_dir(self._static_folder, "")
+            self.logger.debug("static folder indexed, {} files.", len(self._static_index))
+        except OSError:
+            self.logger.warn("static folder {} can't be listed.", self._static_folder)
+
+    def _index_dir(self, folder, prefix):
+        for name in os.listdir(folder):
+            path = folder + "/" + name
+            # 0x4000 is S_IFDIR
+            if os.stat(path)[0] & 0x4000:
+                self._index_dir(path, prefix + "/" + name)
+
+            elif not name.endswith(".gz"):
+                # precompressed variants are served through the manifest
+                self._static_index.add(prefix + "/" + name)
+
+    def is_api_path(self, path):
+        for prefix in self._api_prefixes:
+            if path.startswith(prefix):
+                return True
+
+        return False
 
     async def start(self, addr="0.0.0.0", port=80, backlog=5):
+        self.load_static_manifest()
+        self.index_static_folder()
 
         self.srv = await asyncio.start_server(self.handle_client, addr, port, backlog=backlog)
         self.logger.info("web server started.")
 
     async def stop(self):
+        # open event streams would keep their connections
+        for hub in self._hubs:
+            hub.close()
 
         self.srv.close()
         await self.srv.wait_closed()
         self.logger.info("web server stopped.")
 
+    async def drain(self, timeout_ms, keep=1):
+        """Waits until at most keep requests are in flight (i.e. the caller's own) or timeout_ms passes.
+        The listener stays open, returns True if drained."""
+        start = time.ticks_ms()
+        while self._inflight > keep:
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                self.logger.warn("{} requests still in flight after {}ms.", self._inflight - keep, timeout_ms)
+                return False
+
+            await asyncio.sleep_ms(10)
+
+        return True
+
     async def handle_client(self, reader, writer):
 
         in_addr, in_port = reader.get_extra_info("peername")
-        self.logger.debug("connection from {}:{}.".format(in_addr, in_port))
+        self.logger.debug("connection from {}:{}.", in_addr, in_port)
+
+        # request and header lines over max_header_size are cut off before they fill the heap
+        reader = LineReader(reader, self._max_header_size)
+
+        first = True
+        try:
+            keep_alive = True
+            while keep_alive:
+                # requests are answered in order, so pipelined ones just wait in the reader
+                keep_alive = await self.handle_request(reader, writer, first)
+                first = False
+
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                # peer already gone (i.e. an event stream client)
+                pass
+            self.logger.debug("connection from {}:{} closed.", in_addr, in_port)
+
+    async def handle_request(self, reader, writer, first):
+        """Serve a single request. Returns True if the connection should be kept open."""
+
+        try:
+            first_line = await asyncio.wait_for(reader.readline(), self._line_timeout if first else self._keepalive_timeout)
+        except asyncio.TimeoutError:
+            if first:
+                self.timed_out += 1
+                self.logger.warn("request line timed out, closing.")
+            else:
+                self.logger.debug("connection idle, closing.")
+
+            return False
+        except ValueError:
+            # longer than max_header_size, answered with 431
+            first_line = None
+
+        if first_line == b"":
+            # client closed the connection
+            return False
+
+        if self._inflight >= self._max_inflight:
+            # overloaded, nothing is allocated for this request
+            self.shed += 1
+            self.logger.warn("overloaded, request shed.")
+            await self.send_shed(writer)
+            return False
+
+        self._inflight += 1
+        self.accepted += 1
+        pair = self._pool.acquire()
+        try:
+            return await self.serve_request(first_line, reader, writer, pair[0], pair[1])
+        except asyncio.TimeoutError:
+            # headers or body too slow, just drop the connection
+            self.timed_out += 1
+            self.logger.warn("request timed out, closing.")
+            return False
+        except EOFError:
+            self.logger.debug("client closed the connection mid-request.")
+            return False
+        finally:
+            self._pool.release(pair)
+            self._inflight -= 1
+
+    async def send_shed(self, writer):
+        writer.write(self._shed_response)
+        await writer.drain()
+
+    def has_memory_for(self, size):
+        if self._mem_watermark == 0:
+            return True
+
+        if gc.mem_free() - size >= self._mem_watermark:
+            return True
+
+        # retry after freeing garbage
+        gc.collect()
+        return gc.mem_free() - size >= self._mem_watermark
+
+    async def read_headers(self, reader, req):
+        headers = 0
+        total = 0
+        while True:
+            # Read and parse headers
+            try:
+                line = await reader.readline()
+            except ValueError:
+                raise HTTPException(REQUEST_HEADER_FIELDS_TOO_LARGE, "Header line longer than {} bytes.".format(self._max_header_size), early=True)
+            if line == b"":
+                raise EOFError("headers cut short")
+            # empty line, \r\n or a bare \n like the request line
+            if _line_end(line) == 0: break
+            self.logger.trace("header: {}", line)
+
+            headers += 1
+            if headers > self._max_headers:
+                raise HTTPException(REQUEST_HEADER_FIELDS_TOO_LARGE, "More than {} headers.".format(self._max_headers), early=True)
+
+            if len(line) > self._max_header_size:
+                raise HTTPException(REQUEST_HEADER_FIELDS_TOO_LARGE, "Header line longer than {} bytes.".format(self._max_header_size), early=True)
+
+            total += len(line)
+            if total > self._max_header_bytes:
+                raise HTTPException(REQUEST_HEADER_FIELDS_TOO_LARGE, "Headers longer than {} bytes.".format(self._max_header_bytes), early=True)
+
+            try:
+                header = parse_header(line, self._header_interest)
+            except ValueError:
+                # malformed header
+                raise HTTPException(BAD_REQUEST, "Header \"{}\" of the request was malformed.".format(line))
+
+            if header != None:
+                if header[0] == "content-length" and req.has_header("content-length"):
+                    # two lengths, the body's end is ambiguous
+                    raise HTTPException(BAD_REQUEST, "Content-length repeated.")
+
+                # Using lowercase format i.e. content-type, content-length
+                req.set_header(header[0], header[1])
+
+    async def read_body(self, reader, length, parser):
+        """Feeds length bytes of body to parser as they arrive, returns the parsed data."""
+        while length > 0:
+            chunk = await reader.read(min(length, self._body_chunk))
+            if chunk == b"":
+                raise EOFError("body cut short")
+
+            length -= len(chunk)
+            parser.feed(chunk)
+
+        return parser.finish()
+
+    async def serve_request(self, first_line, reader, writer, request, resp):
+        """request and resp are clean objects from the pool."""
+        start = time.ticks_ms()
+        timing = self._other_timing
+
+        # None until the request line is parsed
         req = None
-        resp = WebResponse()
+        resp.keep_alive_timeout = self._keepalive_timeout
 
         readAll = False
-        connection_closed = False
+        upload = None
 
         try:
-            first_line = await reader.readline()
+            if first_line == None or len(first_line) > self._max_header_size:
+                raise HTTPException(REQUEST_HEADER_FIELDS_TOO_LARGE, "First line of the request too long.", early=True)
 
             try:
-                method, url, _ = first_line.decode().split(" ")
+                method, url, version = parse_request_line(first_line)
             except ValueError:
-                # Not enough values to unpack
                 # malformed first_line
-                if first_line == b"": readAll = True
                 raise HTTPException(BAD_REQUEST, "First line ({}) of the request was malformed.".format(first_line), early=True)
 
-            req = WebRequest(method)
+            req = request
+            req.reset(method, version)
 
             try:
                 req.parse_url(url)
@@ -61,85 +365,153 @@ class WebServer:
                 # malformed url
                 raise HTTPException(BAD_REQUEST, "URL \"{}\" is malformed, reason: {}".format(url, e))
 
-            self.logger.info("-> {} {}".format(req.method, req.path))
+            self.logger.info("-> {} {}", req.method, req.path)
 
-            while True:
-                # Read and parse headers
-                line = await reader.readline()
-                if line == b"\r\n": break
-                self.logger.trace("header: {}".format(line))
+            await asyncio.wait_for(self.read_headers(reader, req), self._header_timeout)
+            self.logger.trace("headers parsed.")
+
+            match = self.router.resolve(req.path)
+            upload_limit = 0
+            if match != None and req.method in match[0]:
+                upload_limit = self._upload_routes.get(match[0][req.method], 0)
+
+            if req.has_header("transfer-encoding"):
+                # chunked bodies aren't parsed, the connection is closed (keep_alive still False)
+                # so the body is never read as the next request
+                raise HTTPException(NOT_IMPLEMENTED, "Transfer-encoding \"{}\" is not implemented.".format(req.get_header("transfer-encoding")))
 
+            if req.has_header("content-length"):
                 try:
-                    key, value = line.decode().strip().split(": ")
+                    l = int(req.get_header("content-length"))
                 except ValueError:
-                    # Not enough values to unpack
-                    # malformed header
-                    raise HTTPException(BAD_REQUEST, "Header \"{}\" of the request was malformed.".format(line))
+                    raise HTTPException(BAD_REQUEST, "Content-length \"{}\" is not a number.".format(req.get_header("content-length")))
 
-                req.set_header(key.lower(), value)
-                # Using lowercase format i.e. content-type, content-length
+                if l < 0:
+                    raise HTTPException(BAD_REQUEST, "Content-length {} is negative.".format(l))
 
-            self.logger.trace("headers parsed.")
+                if l > 0 and upload_limit > 0:
+                    # upload route, the body is left for the route to stream (Upload.save)
+                    if l > upload_limit:
+                        raise HTTPException(PAYLOAD_TOO_LARGE, "Upload of {} bytes, limit is {}.".format(l, upload_limit))
 
-            if req.has_header("content-length"):
-                l = int(req.get_header("content-length"))
-                if l > 0:
-                    # There is data
-                    data_raw = await reader.readexactly(l)
-                    readAll = True
+                    upload = Upload(reader, l, len(self._file_buf), self._upload_timeout)
+                    req.set_upload(upload)
 
-                    ctype = req.get_header("content-type")
-                    if ctype == "application/x-www-form-urlencoded":
-                        for entry in data_raw.decode().split("&"):
-                            try:
-                                key, value = entry.split("=")
-                            except ValueError:
-                                # Not enough values to unpack
-                                # malformed form data
-                                raise HTTPException(BAD_REQUEST, "POST data=\"{}\" not a valid application/x-www-form-urlencoded string.".format(line))
+                elif l > 0:
+                    # There is data
+                    if l > self._max_body:
+                        raise HTTPException(PAYLOAD_TOO_LARGE, "Body of {} bytes, limit is {}.".format(l, self._max_body))
 
-                            req.set_data(key, value)
+                    if not self.has_memory_for(l):
+                        self.shed_memory += 1
+                        self.logger.warn("not enough memory for {} byte body, request shed.", l)
+                        await self.send_shed(writer)
+                        return False
 
-                    # TODO add more content types (for ex. JSON)
+                    ctype = req.get_header("content-type").split(";")[0].strip() if req.has_header("content-type") else None
+                    if ctype == "application/x-www-form-urlencoded":
+                        parser = FormParser(self._max_body_token)
+                    elif ctype == "application/json":
+                        parser = JSONParser(self._max_body_depth, self._max_body_token)
                     else:
                         raise HTTPException(NOT_IMPLEMENTED, "Content-type \"{}\" is not implemented".format(ctype))
 
-            readAll = True
+                    try:
+                        data = await asyncio.wait_for(self.read_body(reader, l, parser), self._body_timeout)
+                    except ValueError as e:
+                        raise HTTPException(BAD_REQUEST, "Body is not valid {}: {}.".format(ctype, e))
+
+                    if not isinstance(data, dict):
+                        raise HTTPException(BAD_REQUEST, "Body has to be a JSON object.")
+
+                    for key in data:
+                        req.set_data(key, data[key])
+
+            readAll = upload == None
             self.logger.trace("data parsed.")
 
+            resp.keep_alive = self._keepalive and req.wants_keep_alive()
+
             if req.method not in SUPPORTED_METHODS:
                 raise HTTPException(NOT_IMPLEMENTED, "Method \"{}\" is not implemented".format(req.method))
 
-            self.logger.trace("resolving route.")
-
-            if req.path in self.routes:
+            if match != None:
                 # there is route
-                route = self.routes[req.path]
+                route, params = match
+                req.set_params(params)
 
                 try:
                     func = route[req.method]
                 except KeyError:
                     raise HTTPException(METHOD_NOT_ALLOWED, "Method \"{}\" is not allowed on {}".format(req.method, req.path))
 
-                async def send(): await resp.send_internal(req, self.logger, writer)
-                resp.define_send(send)
+                timing = self._route_timing[func]
+
+                resp.bind(req, self.logger, writer)
+
+                # cache key is the whole url, query included
+                cached = self._cached_routes.get(func) if req.method == "GET" and self.response_cache != None else None
+                entry = self.response_cache.get(url) if cached != None else None
+                if entry != None:
+                    # the route doesn't run at all, the Accept check still does (a miss would raise too)
+                    if func in self._json_routes:
+                        resp.check_accepts_json(req)
+                    await resp.write_cached(writer, entry[0], entry[1])
+                    self.logger.trace("response sent from cache.")
+
+                else:
+                    self.logger.trace("calling route, sending response.")
+
+                    # raises HTTPException, can raise MemoryError
+                    await func(req, resp)
+                    if upload != None and upload.remaining > 0:
+                        # route didn't read the whole upload, rest of it can't be told from the next request
+                        resp.keep_alive = False
 
-                self.logger.trace("calling route, sending response.")
+                    if not resp.isSent and cached != None:
+                        if resp.body_should_stringify():
+                            self._json_routes.add(func)
+                        entry = resp.serialize(req)
+                        if entry != None:
+                            self.response_cache.put(url, entry[0], entry[1], cached[0], cached[1])
+                            await resp.write_cached(writer, entry[0], entry[1])
 
-                # raises HTTPException, can raise MemoryError
-                await func(req, resp)
-                if not resp.isSent:
-                    await resp.send()
+                    if not resp.isSent:
+                        await resp.send()
 
-                self.logger.trace("route finished gracefully.")
+                    self.logger.trace("route finished gracefully.")
 
-            elif method == "GET" and self._static_folder != None:
+            elif method == "GET" and self._static_folder != None and not self.is_api_path(req.path):
                 # no route, try file, only with GET, if static folder set
                 if req.path == "/": req.path = "/index.html"
+
+                if req.path not in self._static_index:
+                    # no filesystem lookup for files that are not there
+                    raise HTTPException(NOT_FOUND, "Path \"{}\" not found".format(req.path))
+
+                timing = self._static_timing
+
+                etag = None
+                gzip = False
+                if req.path in self._static_manifest:
+                    gz_path = req.path + ".gz"
+                    if gz_path in self._static_manifest and req.accepts_encoding("gzip"):
+                        etag = self._static_manifest[gz_path]
+                        gzip = True
+                    else:
+                        etag = self._static_manifest[req.path]
+
+                    # representation depends on Accept-Encoding
+                    if gz_path in self._static_manifest:
+                        resp.header("vary", "accept-encoding")
+
+                    etag = "\"{}\"".format(etag)
+
                 req.path = self._static_folder + req.path
 
                 try:
-                    await resp.send_file(req.path, writer)
+                    await resp.send_file(req.path, writer, req, etag=etag, gzip=gzip, max_age=self._static_max_age,
+                                         cache=self.static_cache, buf=self._file_buf)
                 except OSError:
                     # no such file
                     raise HTTPException(NOT_FOUND, "Path \"{}\" not found".format(req.path))
@@ -148,38 +520,34 @@ class WebServer:
                 # no route
                 raise HTTPException(NOT_FOUND, "Path \"{}\" not found".format(req.path))
 
-            if resp.isSent:
-                connection_closed = True
-
         except MemoryError as e:
             self.logger.error("Out of Memory.")
             self.logger.error(str(e))
 
-            if not readAll:
-                await reader.read(-1)
+            # request framing is lost, connection can't be reused
+            resp.keep_alive = resp.keep_alive and (readAll or (upload != None and upload.remaining == 0))
 
             resp.clear()
             resp.code(INTERNAL_SERVER_ERROR)
             resp.body("<h1>Out of Memory</h1>")
 
             await resp.send_internal(req, self.logger, writer)
-            connection_closed = True
 
             import micropython
             micropython.mem_info(1)
 
         except HTTPException as e:
-            self.logger.warn("HTTPException {}.".format(e.get_reason()))
+            self.logger.warn("HTTPException {}.", e.get_reason())
             self.logger.warn(e.msg)
 
-            if not readAll:
-                await reader.read(-1)
+            # request framing is lost, connection can't be reused
+            resp.keep_alive = resp.keep_alive and (readAll or (upload != None and upload.remaining == 0))
 
             resp.clear()
             resp.code(e.code)
 
-            if e.early:
-                # req is None, no JSON support (no headers)
+            if e.early or not resp.accepts_json(req):
+                # req is None (no headers) or the client doesn't take JSON
                 resp.body("<h1>{}</h1>".format(e.get_reason()))
                 resp.body("<pre>{}</pre>".format(e.msg))
 
@@ -187,21 +555,99 @@ class WebServer:
                 resp.body(gen_status_report("error", e.msg))
 
             await resp.send_internal(req, self.logger, writer)
-            connection_closed = True
 
-        finally:
-            if not connection_closed:
-                if not readAll:
-                    await reader.read(-1)
+        timing.observe(time.ticks_diff(time.ticks_ms(), start))
+        code = resp.get_code()
+        if code in self._status_count:
+            self._status_count[code].inc()
 
-                await writer.drain()
-                await writer.wait_closed()
+        self.logger.debug("response sent.")
+        return resp.keep_alive
+
+    def static_file_updated(self, path, digest=None):
+        """File path (relative to the static folder, i.e. /index.html) was replaced while running.
+
+        Drops its cached copy and the now stale precompressed variant, updates the manifest
+        (digest is the new sha256 hex, used for the ETag) and the index."""
+
+        if self._static_folder == None:
+            return
 
-            self.logger.debug("response sent.")
+        full = self._static_folder + path
+        if self.static_cache != None:
+            self.static_cache.invalidate(full)
+            self.static_cache.invalidate(full + ".gz")
 
-    def route(self, url, methods=SUPPORTED_METHODS):
+        gz_path = path + ".gz"
+        if gz_path in self._static_manifest:
+            del self._static_manifest[gz_path]
+            try:
+                os.remove(full + ".gz")
+            except OSError:
+                pass
+
+        if digest != None:
+            self._static_manifest[path] = digest[:16]
+        elif path in self._static_manifest:
+            del self._static_manifest[path]
+
+        try:
+            config_parser.save_dict(self._static_folder + ".manifest", self._static_manifest)
+        except OSError:
+            self.logger.warn("static manifest can't be saved.")
+
+        self._static_index.add(path)
+        self.logger.info("static file {} updated.", path)
+
+    def events(self, url, hub, ping=15):
+        """Registers url as a text/event-stream endpoint, every subscriber gets the events
+        published to hub (EventHub). A comment is sent after ping seconds without events,
+        that's when disconnected clients are noticed.
+
+        Streams are long-lived, they don't count towards max_inflight."""
+
+        self._hubs.append(hub)
+        # streams hold their request/response pair
+        self._pool.grow(hub.max_subscribers)
+
+        async def event_stream(req, resp):
+            sub = hub.subscribe()
+            if sub == None:
+                raise HTTPException(SERVICE_UNAVAILABLE, "Too many event subscribers.")
+
+            self._inflight -= 1
+            try:
+                resp.header("content-type", "text/event-stream")
+                resp.header("cache-control", "no-cache")
+                await resp.send_head()
+
+                while True:
+                    data = await sub.get(ping)
+                    if data == None:
+                        break
+
+                    await resp.write(data if data else b": ping\n\n")
+
+            except OSError:
+                self.logger.debug("event subscriber gone.")
+
+            finally:
+                hub.unsubscribe(sub)
+                self._inflight += 1
+
+        self.route(url, methods="GET")(event_stream)
+
+    def invalidate(self, tag):
+        """Drops cached responses of routes added with tag in tags (i.e. "wifi" after a Wi-Fi change)."""
+        if self.response_cache != None:
+            self.response_cache.invalidate_tag(tag)
+
+    def route(self, url, methods=SUPPORTED_METHODS, headers=(), upload=0, cache=None, tags=()):
         """Add route
 
+        headers lists (lowercase) request headers the route reads, besides the ones
+        the server uses itself. Other headers are not kept.
+
         Example:
             @srv.route("/", methods="GET")
             async def root(req: WebRequest, resp: WebResponse):
@@ -214,20 +660,40 @@ class WebServer:
                 resp.send() or raise HTTPException(code, msg)
                 ^ can be omitted
 
+        Segments written as <name> match any single path segment, the value is available
+        with req.get_param("name"), i.e. @srv.route("/sensor/<id>").
+
         Object-like body (tuple, list, dict) can be added only once and will be stringified automatically.
 
         If HTTPException is raised, body and headers will be ignored.
+
+        With upload > 0 the request body (up to upload bytes) isn't read by the server,
+        the route gets it from req.get_upload() and streams it to a file with Upload.save().
+
+        With cache set (seconds, 0 for no expiry) GET responses are kept serialized in the
+        response cache (server's response_cache budget) and sent again without calling the route,
+        until they expire or invalidate() is called with one of tags. Only for routes whose
+        response depends on the url alone.
         """
 
         def decorator(func):
 
-            self.logger.trace("adding route {} ({}) -> {}".format(url, methods, func))
+            self.logger.trace("adding route {} ({}) -> {}", url, methods, func)
 
-            def add_route(method):
-                if url not in self.routes:
-                    self.routes[url] = {}
+            for header in headers:
+                self._header_interest.add(header.lower().encode())
+
+            if upload > 0:
+                self._upload_routes[func] = upload
 
-                self.routes[url][method] = func
+            if cache != None:
+                self._cached_routes[func] = (cache, tuple(tags))
+
+            if func not in self._route_timing:
+                self._route_timing[func] = REGISTRY.histogram("http_request_duration_ms", {"route": url})
+
+            def add_route(method):
+                self.router.add(url, method, func)
 
             if isinstance(methods, str):
                 add_route(methods)
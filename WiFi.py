@@ -1,125 +1,290 @@
+import binascii
+import time
 import uasyncio as asyncio
 import Logger.Logger as Logger
 import config_parser
 import network
+from Metrics.Metrics import REGISTRY
 
 CONFIG_FILE = "wifi.cfg"
 AP_SSID = "ESP 8266"
 AP_PASS = "test1234"
-MAX_TRIES = 20
+# connect by SSID scans all channels, by cached BSSID it fails fast if the AP moved
+CONNECT_TIMEOUT_MS = 10000
+FAST_CONNECT_TIMEOUT_MS = 3000
+CONNECT_POLL_MS = 100
+# seconds between reconnect attempts of the watchdog, doubled after every failure
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
 
 # config keys
 C_MODE = "mode"
 C_SSID = "ssid"
 C_PASS = "pass"
+# last AP connected to, hex BSSID
+C_BSSID = "bssid"
+C_CHANNEL = "channel"
 
 MODE_STA = 0
 MODE_AP = 1
 
+CONFIG_TYPES = { C_MODE: int, C_SSID: str, C_PASS: str, C_BSSID: str, C_CHANNEL: int }
+
+# connect() gave up for good
+_FAILED = (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND, network.STAT_CONNECT_FAIL)
+
 class WiFi:
     def __init__(self, loglevel=Logger.INFO):
         self.logger = Logger.Logger("wifi", loglevel=loglevel)
         self._mode = None
         self._ssid = None
         self._password = None
+        self._ip = None
+        # called with this object after every mode or IP change
+        self._listeners = []
+        # set while a connect is in progress, the watchdog keeps off
+        self._connecting = False
+        # last scan, used to find the BSSID of the network connected to
+        self._last_scan = None
+        self.connect_ms = None
+        self.reconnect_ms = None
+
+        self._config = config_parser.ConfigStore(CONFIG_FILE, CONFIG_TYPES)
+
+        self._connects = REGISTRY.counter("wifi_sta_connects_total")
+        self._fast_connects = REGISTRY.counter("wifi_sta_fast_connects_total")
+        self._link_lost = REGISTRY.counter("wifi_link_lost_total")
+        self._reconnects = REGISTRY.counter("wifi_reconnects_total")
+        REGISTRY.gauge("wifi_last_connect_ms", fn=lambda: self.connect_ms)
+        REGISTRY.gauge("wifi_last_reconnect_ms", fn=lambda: self.reconnect_ms)
+        REGISTRY.counter("config_writes_total", fn=lambda: self._config.writes)
+        REGISTRY.counter("config_writes_elided_total", fn=lambda: self._config.elided)
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+
+    def _changed(self):
+        for callback in self._listeners:
+            callback(self)
 
     async def start(self):
-        try:
-            config = config_parser.read_dict(CONFIG_FILE)
-            self.logger.debug("loaded config file.")
+        config = self._config.load()
 
-            if int(config[C_MODE]) == MODE_STA:
-                self.logger.debug("connecting to {} pass={}.".format(config[C_SSID], config[C_PASS]))
-                await self.start_sta_connect(config[C_SSID], config[C_PASS], new_config=False)
-            else:
-                self.logger.debug("starting AP ssid={}.".format(AP_SSID))
-                self.start_ap()
+        if config.get(C_MODE) == MODE_STA and C_SSID in config and C_PASS in config:
+            self.logger.debug("loaded config, connecting to {}.", config[C_SSID])
+            await self.start_sta_connect(config[C_SSID], config[C_PASS], new_config=False)
+
+        elif config.get(C_MODE) == MODE_AP:
+            self.logger.debug("loaded config, starting AP ssid={}.", AP_SSID)
+            self.start_ap()
 
-        except OSError:
-            self.logger.debug("no config file, starting AP mode.")
+        else:
+            self.logger.debug("no valid config file, starting AP mode.")
             self.start_ap()
 
     async def start_sta_connect(self, ssid, password, new_config):
+        # the watchdog may be reconnecting
+        while self._connecting:
+            await asyncio.sleep_ms(CONNECT_POLL_MS)
+
+        # taken before the first await, the watchdog would see a disconnected STA link below
+        self._connecting = True
+        try:
+            # AP stays up until the new link is (AP+STA), clients keep reaching the device meanwhile
+            sta = network.WLAN(network.STA_IF)
+            sta.active(True)
+
+            if sta.isconnected():
+                sta.disconnect()
+                while sta.isconnected():
+                    await asyncio.sleep(0.1)
+
+            connected = await self._sta_link(sta, ssid, password)
+        finally:
+            self._connecting = False
+
+        if not connected:
+            if new_config:
+                # probably wrong password
+                # revert to AP
+                # TODO LEDs
+                self.logger.info("reverting WiFi configuration. starting {} mode", self.get_mode_str())
+
+                if self._mode == MODE_AP:
+                    sta.active(False)
+                    self.start_ap()
+                else:
+                    await self.start_sta_connect(self._ssid, self._password, new_config=False)
+
+                return
+
+            # old config cannot fail, the watchdog keeps trying
+            self.logger.info("can't connect to {}, retrying in background.", ssid)
+            network.WLAN(network.AP_IF).active(False)
+            self._mode = MODE_STA
+            self._ssid = ssid
+            self._password = password
+            self._ip = None
+            self._changed()
+            return
+
         # Disable AP mode
         network.WLAN(network.AP_IF).active(False)
+        self._sta_up(sta, ssid, password)
 
-        sta = network.WLAN(network.STA_IF)
-        sta.active(True)
+    async def _connect(self, sta, ssid, password, bssid, timeout_ms):
+        """Single connect attempt. Returns True once connected, False on failure or after timeout_ms."""
+        if bssid != None:
+            sta.connect(ssid, password, bssid=bssid)
+        else:
+            sta.connect(ssid, password)
+        self._connects.inc()
 
-        if sta.isconnected():
-            sta.disconnect()
-            while sta.isconnected():
-                await asyncio.sleep(0.1)
+        start = time.ticks_ms()
+        while not sta.isconnected():
+            if sta.status() in _FAILED or time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                sta.disconnect()
+                return False
 
-        sta.connect(ssid, password)
+            await asyncio.sleep_ms(CONNECT_POLL_MS)
 
-        while not sta.isconnected():
-            try_no = 1
-            while not sta.isconnected() and (try_no <= MAX_TRIES or not new_config):
-                self.logger.debug("trying to connect, try {}.".format(try_no))
-                await asyncio.sleep_ms(500)
-                try_no += 1
+        return True
 
-            if sta.isconnected():
-                if new_config:
-                    self.logger.debug("connected to new network, saving config.")
-                    config = { C_MODE: MODE_STA, C_SSID: ssid, C_PASS: password }
-                    config_parser.save_dict(CONFIG_FILE, config)
-                    self.logger.info("config saved.")
-                # old config -> do nothing
+    async def _sta_link(self, sta, ssid, password):
+        """Connects sta, to the cached BSSID first. Returns True if connected."""
+        start = time.ticks_ms()
 
+        connected = False
+        bssid, _ = self._cached_ap(ssid)
+        if bssid != None:
+            connected = await self._connect(sta, ssid, password, bssid, FAST_CONNECT_TIMEOUT_MS)
+            if connected:
+                self._fast_connects.inc()
             else:
-                # not connected
-                if new_config:
-                    # probably wrong password
-                    # revert to AP
-                    # TODO LEDs
-                    self.logger.info("reverting WiFi configuration. starting {} mode".format(self.get_mode_str()))
+                self.logger.debug("cached AP of {} not found, connecting by SSID.", ssid)
 
-                    if self._mode == MODE_AP:
-                        self.start_ap()
-                    else:
-                        await self.start_sta_connect(self._ssid, self._password, new_config=False)
+        if not connected:
+            connected = await self._connect(sta, ssid, password, None, CONNECT_TIMEOUT_MS)
 
-                    return
+        if connected:
+            self.connect_ms = time.ticks_diff(time.ticks_ms(), start)
 
-                # old config cannot fail
+        return connected
 
+    def _sta_up(self, sta, ssid, password):
         self._mode = MODE_STA
         self._ssid = ssid
         self._password = password
         ip, _, _, _ = sta.ifconfig()
-        self.logger.info("connected to {}, ip={}.".format(ssid, ip))
+        self._ip = ip
+        self.logger.info("connected to {} in {}ms, ip={}.", ssid, self.connect_ms, ip)
+        self._changed()
 
-    def start_ap(self):
-        # Disable STA mode
-        network.WLAN(network.STA_IF).active(False)
+        # refreshes the cached AP, flash is only written if it changed
+        config = { C_MODE: MODE_STA, C_SSID: ssid, C_PASS: password }
+        bssid, channel = self._scanned_ap(ssid)
+        if bssid == None:
+            bssid, channel = self._cached_ap(ssid)
+        if bssid != None:
+            config[C_BSSID] = binascii.hexlify(bssid).decode()
+            config[C_CHANNEL] = channel
+        self._save_config(config)
+
+    def _cached_ap(self, ssid):
+        """(bssid, channel) of the AP last connected to if it was on ssid, else (None, None)."""
+        if self._config.get(C_SSID) != ssid or self._config.get(C_BSSID) == None:
+            return None, None
+
+        return binascii.unhexlify(self._config.get(C_BSSID)), self._config.get(C_CHANNEL)
+
+    def _scanned_ap(self, ssid):
+        """(bssid, channel) of the strongest AP on ssid in the last scan, else (None, None)."""
+        best = None
+        for net in self._last_scan or ():
+            if net[0].decode() == ssid and (best == None or net[3] > best[3]):
+                best = net
+
+        if best == None:
+            return None, None
+
+        return best[1], best[2]
+
+    async def watchdog(self, interval=2):
+        """Runs forever: notices a lost STA link and reconnects, waiting RECONNECT_MIN seconds
+        after the first failed attempt, doubled up to RECONNECT_MAX. The servers keep running."""
+        sta = network.WLAN(network.STA_IF)
 
+        while True:
+            await asyncio.sleep(interval)
+            if self._mode != MODE_STA or self._connecting or sta.isconnected():
+                continue
+
+            self._link_lost.inc()
+            self.logger.info("link to {} lost.", self._ssid)
+            lost = time.ticks_ms()
+            delay = RECONNECT_MIN
+
+            # set_config may change the mode meanwhile
+            while self._mode == MODE_STA and not self._connecting and not sta.isconnected():
+                ssid = self._ssid
+                password = self._password
+                self._connecting = True
+                try:
+                    connected = await self._sta_link(sta, ssid, password)
+                finally:
+                    self._connecting = False
+
+                if connected:
+                    self.reconnect_ms = time.ticks_diff(time.ticks_ms(), lost)
+                    self._reconnects.inc()
+                    self._sta_up(sta, ssid, password)
+                    break
+
+                self.logger.debug("reconnect failed, next try in {}s.", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    def start_ap(self):
         ap = network.WLAN(network.AP_IF)
         ap.active(True)
         ap.config(essid=AP_SSID, password=AP_PASS)
 
+        # Disable STA mode, once the AP is up
+        network.WLAN(network.STA_IF).active(False)
+
         self._mode = MODE_AP
         self._ssid = AP_SSID
         self._password = AP_PASS
         ip, _, _, _ = ap.ifconfig()
-        self.logger.info("started AP <{}> pass={}, ip={}".format(AP_SSID, AP_PASS, ip))
+        self._ip = ip
+        self.logger.info("started AP <{}>, ip={}", AP_SSID, ip)
+        self._changed()
+
+        self._save_config({ C_MODE: MODE_AP })
 
-        config = { C_MODE: MODE_AP }
-        config_parser.save_dict(CONFIG_FILE, config)
-        self.logger.info("config saved.")
+    def _save_config(self, config):
+        # unchanged config (i.e. AP mode on every boot) doesn't touch flash
+        if self._config.replace(config):
+            self.logger.info("config saved.")
+        else:
+            self.logger.debug("config unchanged.")
 
     def scan(self):
+        if self._connecting:
+            # AP mode scan would take down the STA link being brought up
+            raise OSError("connecting")
+
         sta = network.WLAN(network.STA_IF)
 
         if self._mode == MODE_STA:
-            return sta.scan()
+            self._last_scan = sta.scan()
+            return self._last_scan
 
         # AP mode
         sta.active(True)
-        scan = sta.scan()
+        self._last_scan = sta.scan()
         sta.active(False)
-        return scan
+        return self._last_scan
 
     def get_mode(self):
         return self._mode
@@ -141,6 +306,10 @@ class WiFi:
             return None
 
     def get_current_ip(self):
+        # cached on every mode change
+        if self._ip != None:
+            return self._ip
+
         wlan = self.get_active_interface()
         if wlan == None:
             return None
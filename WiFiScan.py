@@ -0,0 +1,115 @@
+import time
+import uasyncio as asyncio
+import Logger.Logger as Logger
+from Metrics.Metrics import REGISTRY
+
+class ScanService:
+    """Wi-Fi scans run off the request path.
+
+    Results are cached for ttl seconds. A stale snapshot is still served right away
+    while a refresh runs in the background, concurrent refreshes share one scan.
+    With interval > 0 the cache is also refreshed on that schedule (seconds)."""
+
+    def __init__(self, wifi, ttl=30, interval=0, loglevel=Logger.INFO):
+        self.logger = Logger.Logger("scan", loglevel=loglevel)
+        self._wifi = wifi
+        self.ttl = ttl
+        self.interval = interval
+
+        self._results = None
+        self._time = None
+        # Event of the scan in flight, None when idle
+        self._pending = None
+        self._task = None
+        # called with this object after every successful scan
+        self._listeners = []
+
+        self.scans = 0
+        self.scan_ms = None
+        self._scan_timing = REGISTRY.histogram("wifi_scan_duration_ms", buckets=(500, 1000, 2000, 3000, 5000, 10000))
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+
+    async def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._schedule())
+
+        self.logger.info("scan service started.")
+
+    async def stop(self):
+        if self._task != None:
+            self._task.cancel()
+            self._task = None
+
+        # don't switch interfaces under a running scan
+        if self._pending != None:
+            await self._pending.wait()
+
+        self.logger.info("scan service stopped.")
+
+    async def _schedule(self):
+        while True:
+            if self._results == None or self.age() >= self.interval:
+                await self.refresh()
+
+            await asyncio.sleep(self.interval)
+
+    def age(self):
+        """Seconds since the last scan, None if there was none."""
+        if self._time == None:
+            return None
+
+        return time.ticks_diff(time.ticks_ms(), self._time) // 1000
+
+    def _start_refresh(self):
+        # at most one scan in flight, later callers get the same Event
+        if self._pending == None:
+            self._pending = asyncio.Event()
+            asyncio.create_task(self._scan())
+
+        return self._pending
+
+    async def refresh(self):
+        await self._start_refresh().wait()
+
+    async def _scan(self):
+        try:
+            start = time.ticks_ms()
+            # blocks the loop for the duration of the scan (no async scan in the firmware)
+            self._results = self._wifi.scan()
+            self._time = time.ticks_ms()
+
+            self.scans += 1
+            self.scan_ms = time.ticks_diff(self._time, start)
+            self._scan_timing.observe(self.scan_ms)
+            self.logger.debug("scan took {}ms, {} networks.", self.scan_ms, len(self._results))
+
+            for callback in self._listeners:
+                callback(self)
+
+        except OSError as e:
+            self.logger.warn("scan failed: {}.", e)
+
+        finally:
+            pending = self._pending
+            self._pending = None
+            pending.set()
+
+    def peek(self):
+        """Returns (scan results, age in seconds) as they are, results are None before the first scan."""
+        return self._results, self.age()
+
+    async def get(self):
+        """Returns (scan results, age in seconds). Raises OSError if there are no results."""
+
+        if self._results == None:
+            await self.refresh()
+            if self._results == None:
+                raise OSError("scan failed")
+
+        elif self.age() >= self.ttl:
+            # serve the old snapshot now, refresh for the next request
+            self._start_refresh()
+
+        return self._results, self.age()
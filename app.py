@@ -1,27 +1,47 @@
 import binascii
+import time
 import uasyncio as asyncio
 import Logger.Logger as Logger
+from Logger.RingSink import RingSink
+import Metrics.Metrics as Metrics
 import WiFi
+from WiFiScan import ScanService
 from WebServer.HTTPException import *
 from WebServer.WebRequest import WebRequest
 from WebServer.WebResponse import WebResponse
 from WebServer.WebServer import WebServer, gen_status_report
+from WebServer.EventHub import EventHub
 from Multicast.Multicast import Multicast
 
 LOGLEVEL = Logger.DEBUG
+# ms other requests get to finish before Wi-Fi is switched
+DRAIN_MS = 2000
+# recent log records (info and above), served at /logs without authentication,
+# so nothing logged may carry a secret
+ringlog = RingSink(64, loglevel=Logger.INFO)
+Logger.add_sink(ringlog)
+
 logger = Logger.Logger("main", loglevel=LOGLEVEL)
 wifi = WiFi.WiFi(loglevel=LOGLEVEL)
-srv = WebServer(loglevel=LOGLEVEL)
+# static cache holds index.html.gz (~1.6 KB) and style.css, the uncompressed index.html (5.4 KB,
+# only for clients without gzip) is streamed from flash instead.
+# response cache: a /wifi_scan entry is ~130 B per network + ~170 B, 2816 B fits 19 networks
+# (larger scans are encoded on every request), the rest is left for /wifi_mode
+srv = WebServer(loglevel=LOGLEVEL, static="static", static_cache=4096, static_cache_entry=2048,
+                mem_watermark=4096, response_cache=3072, response_cache_entry=2816)
 mcast = Multicast("esp8266", wifi, loglevel=LOGLEVEL)
+scanner = ScanService(wifi, ttl=30, interval=60, loglevel=LOGLEVEL)
+# device state pushed to /events subscribers
+events = EventHub(max_subscribers=4)
+srv.events("/events", events)
 
 name_map = ("ssid", "bssid", "channel", "rssi", "authmode", "hidden")
 auth_map = ("open", "WEP", "WPA-PSK", "WPA2-PSK", "WPA/WPA2-PSK")
 
-@srv.route("/wifi_scan", methods="GET")
-async def wifi_scan(req: WebRequest, resp: WebResponse):
+def scan_report(networks, age):
     netinfo = []
 
-    for network in wifi.scan():
+    for network in networks:
         net = {}
         for i, val in enumerate(network):
             if i == 1: val = binascii.hexlify(val, ":")
@@ -31,10 +51,54 @@ async def wifi_scan(req: WebRequest, resp: WebResponse):
         net["connected"] = (net["ssid"].decode() == wifi.get_ssid())
         netinfo.append(net)
 
+    return {"age": age, "networks": netinfo}
+
+def publish_scan(scanner):
+    networks, age = scanner.peek()
+    if networks != None:
+        events.publish("scan", scan_report(networks, age))
+
+def publish_wifi(wifi):
+    events.publish("wifi", {"mode": wifi.get_mode_str(), "ssid": wifi.get_ssid(), "ip": wifi.get_current_ip()})
+    # connected flags changed
+    publish_scan(scanner)
+
+# cached responses tagged with these
+wifi.on_change(lambda wifi: srv.invalidate("wifi"))
+scanner.on_change(lambda scanner: srv.invalidate("scan"))
+wifi.on_change(publish_wifi)
+scanner.on_change(publish_scan)
+
+reconfigure_ms = Metrics.REGISTRY.gauge("wifi_reconfigure_ms")
+
+async def reconfigure(ssid=None, password=None):
+    # AP without ssid. The servers stay up, only the scan service pauses (a scan would switch interfaces)
+    start = time.ticks_ms()
+    await srv.drain(DRAIN_MS)
+    await scanner.stop()
+    try:
+        if ssid == None:
+            wifi.start_ap()
+        else:
+            await wifi.start_sta_connect(ssid, password, new_config=True)
+    finally:
+        await scanner.start()
+
+    reconfigure_ms.set(time.ticks_diff(time.ticks_ms(), start))
+    logger.info("reconfigured in {}ms.", reconfigure_ms.get())
+
+# age in the cached response lags by up to 5 seconds
+@srv.route("/wifi_scan", methods="GET", cache=5, tags=("wifi", "scan"))
+async def wifi_scan(req: WebRequest, resp: WebResponse):
+    try:
+        networks, age = await scanner.get()
+    except OSError as e:
+        raise HTTPException(SERVICE_UNAVAILABLE, "Scan failed: {}.".format(e))
+
     resp.header("content-type", "application/json")
-    resp.body(netinfo)
+    resp.body(scan_report(networks, age))
 
-@srv.route("/wifi_mode", methods="GET")
+@srv.route("/wifi_mode", methods="GET", cache=0, tags=("wifi",))
 async def wifi_scan(req: WebRequest, resp: WebResponse):
     resp.header("content-type", "application/json")
     resp.body({"mode": wifi.get_mode_str()})
@@ -45,7 +109,7 @@ async def set_config_post(req: WebRequest, resp: WebResponse):
     resp.header("content-type", "application/json")
 
     def send_status_log(status):
-        logger.info("wifi status: {}".format(status))
+        logger.info("wifi status: {}", status)
         resp.body(gen_status_report("ok", status))
 
     try:
@@ -57,9 +121,7 @@ async def set_config_post(req: WebRequest, resp: WebResponse):
         if wifi.get_mode() != WiFi.MODE_AP:
             send_status_log("Starting AP.")
             await resp.send()
-            await stop_servers()
-            wifi.start_ap()
-            await start_servers()
+            await reconfigure()
 
         else:
             send_status_log("Not modified.")
@@ -71,12 +133,16 @@ async def set_config_post(req: WebRequest, resp: WebResponse):
         except KeyError:
             raise HTTPException(BAD_REQUEST, "STA mode requires SSID and PASS")
 
+        # JSON bodies can carry any type, checked before the response goes out (config lines can't hold \n)
+        if not isinstance(ssid, str) or not isinstance(password, str):
+            raise HTTPException(BAD_REQUEST, "SSID and PASS have to be strings.")
+        if not 0 < len(ssid) <= 32 or len(password) > 64 or "\n" in ssid or "\n" in password:
+            raise HTTPException(BAD_REQUEST, "Bad SSID or PASS.")
+
         if wifi.get_mode() != WiFi.MODE_STA or ssid != wifi.get_ssid():
             send_status_log("Starting STA mode, ssid={}.".format(ssid))
             await resp.send()
-            await stop_servers()
-            await wifi.start_sta_connect(ssid, password, new_config=True)
-            await start_servers()
+            await reconfigure(ssid, password)
 
         else:
             send_status_log("Not modified.")
@@ -84,19 +150,79 @@ async def set_config_post(req: WebRequest, resp: WebResponse):
     else:
         raise HTTPException(BAD_REQUEST, "Wrong mode given.")
 
-connections = (srv, mcast)
+UPLOAD_NAME_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-"
+
+@srv.route("/upload/<name>", methods="POST", headers=("x-content-sha256",), upload=64*1024)
+async def upload_static(req: WebRequest, resp: WebResponse):
+    # replaces static/<name> with the request body, i.e.
+    # curl --data-binary @static/index.html -H "x-content-sha256: $(sha256sum ...)" http://<ip>/upload/index.html
+    name = req.get_param("name")
+    for char in name:
+        if char not in UPLOAD_NAME_CHARS:
+            raise HTTPException(BAD_REQUEST, "Bad file name.")
+    if name.startswith(".") or name.endswith(".gz") or name.endswith(".tmp"):
+        raise HTTPException(BAD_REQUEST, "Bad file name.")
+
+    upload = req.get_upload()
+    if upload == None:
+        raise HTTPException(BAD_REQUEST, "No body.")
+
+    if not req.has_header("x-content-sha256"):
+        raise HTTPException(BAD_REQUEST, "No x-content-sha256 header.")
+
+    try:
+        digest = await upload.save("static/" + name, req.get_header("x-content-sha256"))
+    except ValueError as e:
+        raise HTTPException(BAD_REQUEST, "Upload rejected: {}.".format(e))
+    except OSError as e:
+        raise HTTPException(INTERNAL_SERVER_ERROR, "Upload failed: {}.".format(e))
+
+    srv.static_file_updated("/" + name, digest)
+    logger.info("uploaded {}, {} bytes at {} KB/s.", name, upload.length, upload.kbps)
+
+    stats = upload.stats()
+    stats["sha256"] = digest
+    resp.header("content-type", "application/json")
+    resp.body(stats)
+
+@srv.route("/logs", methods="GET")
+async def logs(req: WebRequest, resp: WebResponse):
+    since = 0
+    if req.has_urldata("since"):
+        try:
+            since = int(req.get_urldata("since"))
+        except ValueError:
+            raise HTTPException(BAD_REQUEST, "since must be a number.")
+
+    # records logged while sending are left for the next request (?since=<x-log-next>)
+    until = ringlog.next_seq()
+
+    resp.header("content-type", "text/plain")
+    resp.header("x-log-next", until)
+    resp.stream(ringlog.lines(since, until))
+
+@srv.route("/metrics", methods="GET")
+async def metrics(req: WebRequest, resp: WebResponse):
+    if req.has_urldata("format") and req.get_urldata("format") == "prometheus":
+        resp.header("content-type", "text/plain; version=0.0.4")
+        resp.stream(Metrics.REGISTRY.prometheus())
+    else:
+        resp.header("content-type", "application/json")
+        resp.body(Metrics.REGISTRY.to_json())
+
+connections = (srv, mcast, scanner)
 
 async def start_servers():
     await asyncio.gather(*[x.start() for x in connections])
     logger.debug("servers started.")
 
-async def stop_servers():
-    await asyncio.gather(*[x.stop() for x in connections])
-    logger.debug("servers stopped.")
-
 async def main():
+    asyncio.create_task(Metrics.monitor_loop_lag())
+
     await wifi.start()
     await start_servers()
+    # reconnects a lost STA link, the servers stay up meanwhile
+    asyncio.create_task(wifi.watchdog())
 
     while True:
         await asyncio.sleep(10)
@@ -0,0 +1,337 @@
+# asyncio load generators for the web server (HTTP/1.1) and the multicast ID protocol.
+# Plain CPython, talks to a running server (device or sim/run.py).
+
+import asyncio
+import random
+import socket
+import time
+
+REQUESTS = {
+    "static": b"GET / HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n",
+    "static_gzip": b"GET / HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\nAccept-Encoding: gzip\r\n",
+    "css": b"GET /style.css HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n",
+    "mode": b"GET /wifi_mode HTTP/1.1\r\nHost: bench\r\nAccept: application/json\r\n",
+    "scan": b"GET /wifi_scan HTTP/1.1\r\nHost: bench\r\nAccept: application/json\r\n",
+    "notfound": b"GET /no/such/file.html HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n",
+    # the server answers 400 and closes the connection
+    "malformed": b"THIS IS NOT HTTP\r\n",
+}
+
+MCAST_GROUP = "239.255.173.63"
+MCAST_PORT = 1200
+
+def parse_mix(mix):
+    """"static=3,mode=1" -> [("static", 3), ("mode", 1)]"""
+    out = []
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        if name not in REQUESTS:
+            raise ValueError("unknown request kind {}, known: {}".format(name, ", ".join(REQUESTS)))
+        out.append((name, float(weight) if weight else 1.0))
+    return out
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {}
+
+    values = sorted(values)
+    out = {}
+    for p in points:
+        i = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+        out["p{}".format(p)] = round(values[i], 3)
+    out["max"] = round(values[-1], 3)
+    out["mean"] = round(sum(values) / len(values), 3)
+    return out
+
+async def read_response(reader):
+    """Returns (status, headers, bytes on the wire)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed before response")
+
+    size = len(status_line)
+    status = int(status_line.split(b" ")[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        size += len(line)
+        if line in (b"\r\n", b""):
+            break
+        key, _, value = line.decode().partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    if "content-length" in headers:
+        size += len(await reader.readexactly(int(headers["content-length"])))
+
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            line = await reader.readline()
+            size += len(line)
+            length = int(line.strip(), 16)
+            size += len(await reader.readexactly(length + 2))
+            if length == 0:
+                break
+
+    elif status != 304 and status >= 200:
+        # body ends with the connection
+        size += len(await reader.read())
+
+    return status, headers, size
+
+class HTTPResult:
+    def __init__(self):
+        self.latencies = []
+        self.status = {}
+        self.errors = 0
+        self.bytes = 0
+        self.connections = 0
+
+    def to_dict(self, elapsed):
+        done = len(self.latencies)
+        return {
+            "requests": done + self.errors,
+            "completed": done,
+            "errors": self.errors,
+            "connections": self.connections,
+            "status": {str(k): v for k, v in sorted(self.status.items())},
+            "elapsed_s": round(elapsed, 3),
+            "rps": round(done / elapsed, 1) if elapsed > 0 else 0,
+            "latency_ms": percentiles(self.latencies),
+            "bytes_per_request": round(self.bytes / done, 1) if done else 0,
+        }
+
+async def _worker(host, port, kinds, keepalive, result):
+    reader = writer = None
+    for kind in kinds:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+                result.connections += 1
+
+            request = REQUESTS[kind]
+            if kind != "malformed":
+                request += b"Connection: keep-alive\r\n\r\n" if keepalive else b"Connection: close\r\n\r\n"
+
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, headers, size = await read_response(reader)
+            result.latencies.append((time.perf_counter() - start) * 1000)
+
+            result.status[status] = result.status.get(status, 0) + 1
+            result.bytes += size
+
+            if not keepalive or headers.get("connection") == "close":
+                writer.close()
+                writer = None
+
+        except (ConnectionError, asyncio.IncompleteReadError, OSError, ValueError, IndexError):
+            result.errors += 1
+            if writer is not None:
+                writer.close()
+                writer = None
+
+    if writer is not None:
+        writer.close()
+
+async def http_load(host, port, mix="mode", requests=200, concurrency=4, keepalive=True, seed=1):
+    """Spreads requests (kinds drawn from mix) over concurrency connections/workers."""
+    weights = parse_mix(mix)
+    rng = random.Random(seed)
+    names = [name for name, _ in weights]
+    kinds = rng.choices(names, weights=[w for _, w in weights], k=requests)
+
+    result = HTTPResult()
+    start = time.perf_counter()
+    await asyncio.gather(*[_worker(host, port, kinds[i::concurrency], keepalive, result) for i in range(concurrency)])
+    return result.to_dict(time.perf_counter() - start)
+
+async def slow_clients(host, port, count=8, interval=0.5, duration=10):
+    """Slowloris: connections that send a request one byte every interval seconds.
+    Returns how many were dropped by the server before finishing."""
+    request = REQUESTS["mode"] + b"\r\n"
+
+    async def trickle():
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            return True
+
+        deadline = time.monotonic() + duration
+        try:
+            for byte in request:
+                if time.monotonic() > deadline:
+                    break
+                writer.write(bytes((byte,)))
+                await writer.drain()
+                await asyncio.sleep(interval)
+                if reader.at_eof():
+                    return True
+            return False
+        except OSError:
+            return True
+        finally:
+            writer.close()
+
+    dropped = await asyncio.gather(*[trickle() for _ in range(count)])
+    return sum(1 for d in dropped if d)
+
+async def sse_clients(host, port, count=4, duration=10, path="/events"):
+    """Subscribers holding a text/event-stream open for duration seconds.
+    Returns events received per client, None for a client that was refused."""
+
+    async def subscribe():
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            return None
+
+        events = 0
+        try:
+            writer.write("GET {} HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n".format(path).encode())
+            await writer.drain()
+            status = await reader.readline()
+            if b" 200 " not in status:
+                return None
+
+            deadline = time.monotonic() + duration
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    line = await asyncio.wait_for(reader.readline(), left)
+                except asyncio.TimeoutError:
+                    break
+                if line == b"":
+                    break
+                if line.startswith(b"event:"):
+                    events += 1
+            return events
+        except OSError:
+            return events
+        finally:
+            writer.close()
+
+    return await asyncio.gather(*[subscribe() for _ in range(count)])
+
+async def pollers(host, port, count=4, interval=0.5, duration=10, kind="mode"):
+    """Clients asking for the state every interval seconds over keep-alive connections.
+    Returns responses received per client."""
+    request = REQUESTS[kind] + b"Connection: keep-alive\r\n\r\n"
+
+    async def poll():
+        responses = 0
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            return responses
+
+        deadline = time.monotonic() + duration
+        try:
+            while time.monotonic() < deadline:
+                writer.write(request)
+                await writer.drain()
+                _, headers, _ = await read_response(reader)
+                responses += 1
+                if headers.get("connection") == "close":
+                    break
+                await asyncio.sleep(interval)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            writer.close()
+        return responses
+
+    return await asyncio.gather(*[poll() for _ in range(count)])
+
+async def probe(host, port, interval=0.05, duration=5, timeout=1.0, kind="mode"):
+    """One request per new connection every interval seconds.
+    Returns the longest time in ms between two answered probes and the failed probe count."""
+    request = REQUESTS[kind] + b"Connection: close\r\n\r\n"
+    last_ok = None
+    longest = 0
+    failed = 0
+
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        sent = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            try:
+                writer.write(request)
+                await writer.drain()
+                await asyncio.wait_for(read_response(reader), timeout)
+            finally:
+                writer.close()
+
+            now = time.monotonic()
+            if last_ok != None:
+                longest = max(longest, now - last_ok)
+            last_ok = now
+
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError, ValueError, IndexError):
+            failed += 1
+
+        await asyncio.sleep(max(0, interval - (time.monotonic() - sent)))
+
+    return round(longest * 1000, 1), failed
+
+class _MulticastClient(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.replies = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.replies.put_nowait((time.perf_counter(), data))
+
+async def _mcast_endpoint():
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.bind(("0.0.0.0", 0))
+    return await loop.create_datagram_endpoint(_MulticastClient, sock=sock)
+
+async def mcast_ping(count=50, name="any", target=MCAST_GROUP, timeout=1.0):
+    """Sequential ID queries, latency of every answered one."""
+    transport, client = await _mcast_endpoint()
+    latencies = []
+    lost = 0
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            transport.sendto("ID {}".format(name).encode(), (target, MCAST_PORT))
+            try:
+                t, _ = await asyncio.wait_for(client.replies.get(), timeout)
+                latencies.append((t - start) * 1000)
+            except asyncio.TimeoutError:
+                lost += 1
+    finally:
+        transport.close()
+
+    return {"queries": count, "answered": len(latencies), "lost": lost, "latency_ms": percentiles(latencies)}
+
+async def mcast_flood(count=1000, name="any", target=MCAST_GROUP, malformed_ratio=0.0, settle=1.0, seed=1):
+    """Sends count queries as fast as possible, counts replies."""
+    rng = random.Random(seed)
+    transport, client = await _mcast_endpoint()
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            query = b"BOGUS" if rng.random() < malformed_ratio else "ID {}".format(name).encode()
+            transport.sendto(query, (target, MCAST_PORT))
+            if i % 50 == 0:
+                # let the socket buffers drain
+                await asyncio.sleep(0)
+        sent = time.perf_counter() - start
+
+        await asyncio.sleep(settle)
+        replies = {"ID": 0, "ERR": 0}
+        while not client.replies.empty():
+            _, data = client.replies.get_nowait()
+            kind = data.split(b" ")[0].decode()
+            replies[kind] = replies.get(kind, 0) + 1
+    finally:
+        transport.close()
+
+    return {"queries": count, "send_s": round(sent, 3), "qps": round(count / sent, 1), "replies": replies}
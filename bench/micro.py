@@ -0,0 +1,491 @@
+# In-process microbenchmarks of the request path building blocks (CPython, see sim/host.py).
+# Absolute numbers say little about the device, compare runs against each other.
+#
+# Usage: python bench/micro.py [--out FILE]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "sim"))
+import host
+
+host.install()
+
+import Logger.Logger as Logger
+from WebServer.BodyParser import FormParser, JSONParser
+from WebServer.HTTPParser import DEFAULT_INTEREST, parse_request_line, parse_header
+from WebServer.Router import Router
+from WebServer.WebResponse import json_dump_stream
+
+def _ns_per_op(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return round((time.perf_counter() - start) * 1e9 / n, 1)
+
+# JSON encoder
+
+async def _legacy_json_dump(obj, write):
+    # the encoder before the buffered one, one awaited write (and drain) per token
+    if obj is None:
+        await write("null")
+    elif isinstance(obj, str):
+        await write('"'); await write(obj); await write('"')
+    elif isinstance(obj, bool):
+        await write("true" if obj else "false")
+    elif isinstance(obj, int) or isinstance(obj, float):
+        await write(str(obj))
+    elif isinstance(obj, bytes):
+        await write('"')
+        for x in obj: await write(chr(x))
+        await write('"')
+    elif isinstance(obj, dict):
+        await write("{")
+        for i, key in enumerate(obj):
+            await write('"'); await write(key); await write('":')
+            await _legacy_json_dump(obj[key], write)
+            if i < len(obj)-1: await write(",")
+        await write("}")
+    else:
+        await write("[")
+        for i, entry in enumerate(obj):
+            await _legacy_json_dump(entry, write)
+            if i < len(obj)-1: await write(",")
+        await write("]")
+
+def scan_payload(networks=20):
+    # shaped like the /wifi_scan response
+    nets = []
+    for i in range(networks):
+        nets.append({"ssid": "network-{}".format(i).encode(), "bssid": b"12:34:56:78:9a:bc", "channel": i % 13 + 1,
+                     "rssi": -40 - i, "authmode": "WPA2-PSK", "hidden": False, "connected": i == 0})
+    return {"age": 3, "networks": nets}
+
+def bench_json(networks=20, rounds=50):
+    payload = scan_payload(networks)
+
+    async def legacy():
+        writes = 0
+        async def write(s):
+            nonlocal writes
+            writes += 1
+            await asyncio.sleep(0)
+        await _legacy_json_dump(payload, write)
+        return writes
+
+    async def buffered():
+        writes = 0
+        for _ in json_dump_stream(payload):
+            writes += 1
+            await asyncio.sleep(0)
+        return writes
+
+    async def run(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            writes = await fn()
+        return writes, round((time.perf_counter() - start) * 1e6 / rounds, 1)
+
+    out = {"networks": networks, "bytes": sum(len(c) for c in json_dump_stream(payload))}
+    for name, fn in (("legacy", legacy), ("buffered", buffered)):
+        writes, us = asyncio.run(run(fn))
+        out[name] = {"writes": writes, "us_per_response": us}
+
+    return out
+
+# request parsing
+
+_REQUEST = (
+    b"GET /wifi_mode?x=1 HTTP/1.1\r\n",
+    b"Host: 192.168.4.1\r\n",
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/118.0\r\n",
+    b"Accept: application/json, text/plain, */*\r\n",
+    b"Accept-Language: en-US,en;q=0.5\r\n",
+    b"Accept-Encoding: gzip, deflate\r\n",
+    b"Connection: keep-alive\r\n",
+    b"Referer: http://192.168.4.1/\r\n",
+)
+
+# every one of these has to raise ValueError
+MALFORMED_LINES = (
+    b"\r\n", b"GET\r\n", b"GET /\r\n", b"GET / \r\n", b" GET / HTTP/1.1\r\n", b"GET  / HTTP/1.1\r\n",
+    b"GET / HTTP/1.1 extra\r\n", b"GET / FTP/1.0\r\n", b"GET / http/1.1\r\n", b"\x00\x01\x02\r\n",
+    b"GET /" + b"a" * 600, b"GET / HTTP/1.1 \r\n",
+)
+MALFORMED_HEADERS = (b": value\r\n", b"no colon here\r\n", b"\r\n", b":\r\n")
+# bare \n line ends are accepted too
+VALID_LINES = (b"GET / HTTP/1.1\r\n", b"GET / HTTP/1.1\n", b"POST /set_config?a=b HTTP/1.0\n")
+
+def bench_parser(rounds=20000):
+    """Raises AssertionError if any malformed line of the corpus is accepted or a valid one rejected."""
+    interest = set(DEFAULT_INTEREST)
+
+    def parse():
+        parse_request_line(_REQUEST[0])
+        for line in _REQUEST[1:]:
+            parse_header(line, interest)
+
+    def rejected(fn, corpus):
+        accepted = []
+        for case in corpus:
+            try:
+                fn(case)
+                accepted.append(repr(case[:32]))
+            except ValueError:
+                pass
+        return accepted
+
+    accepted = rejected(parse_request_line, MALFORMED_LINES) + rejected(lambda l: parse_header(l, interest), MALFORMED_HEADERS)
+    assert accepted == [], "malformed input accepted: {}".format(accepted)
+    for line in VALID_LINES:
+        parse_request_line(line)
+
+    return {
+        "ns_per_request": _ns_per_op(parse, rounds),
+        "malformed_cases": len(MALFORMED_LINES) + len(MALFORMED_HEADERS),
+    }
+
+# routing
+
+def bench_router(sizes=(8, 64, 512), rounds=20000):
+    out = []
+    for n in sizes:
+        router = Router()
+        for i in range(n):
+            router.add("/api/route{}".format(i), "GET", None)
+            router.add("/api/item{}/<id>/value".format(i), "GET", None)
+
+        last = n - 1
+        out.append({
+            "routes": len(router),
+            "exact_ns": _ns_per_op(lambda: router.resolve("/api/route{}".format(last)), rounds),
+            "param_ns": _ns_per_op(lambda: router.resolve("/api/item{}/42/value".format(last)), rounds),
+            "miss_ns": _ns_per_op(lambda: router.resolve("/static/missing.html"), rounds),
+        })
+
+    return out
+
+# logging
+
+class _NullSink:
+    @staticmethod
+    def emit(logger, level, msg):
+        pass
+
+def bench_logging(rounds=50000):
+    logger = Logger.Logger("bench", loglevel=Logger.INFO)
+    ip, port = "192.168.4.2", 51234
+
+    out = {
+        # disabled level, arguments never formatted
+        "disabled_lazy_ns": _ns_per_op(lambda: logger.debug("connection from {}:{}.", ip, port), rounds),
+        # what call sites did before lazy formatting
+        "disabled_eager_ns": _ns_per_op(lambda: logger.debug("connection from {}:{}.".format(ip, port)), rounds),
+    }
+
+    sinks = Logger._sinks[:]
+    Logger._sinks[:] = [_NullSink]
+    try:
+        out["enabled_ns"] = _ns_per_op(lambda: logger.info("connection from {}:{}.", ip, port), rounds)
+    finally:
+        Logger._sinks[:] = sinks
+
+    return out
+
+# request bodies
+
+def _peak(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_body(size=4096, chunk=128):
+    """Peak memory of parsing a size byte body, whole (like readexactly before) vs streamed in chunks."""
+    fields = size // 32
+    form = "&".join("field{}=value%20{}+{}".format(i, i, "x" * 12) for i in range(fields)).encode()
+    body = json.dumps({"field{}".format(i): ["value {}".format(i), i, True] for i in range(fields)}).encode()
+
+    def whole_form():
+        # body copy as readexactly returned it
+        raw = bytes(bytearray(form))
+        out = {}
+        for entry in raw.decode().split("&"):
+            key, value = entry.split("=")
+            out[key] = value
+
+    def whole_json():
+        json.loads(bytes(bytearray(body)))
+
+    def streamed(data, parser):
+        def run():
+            p = parser()
+            for i in range(0, len(data), chunk):
+                p.feed(data[i:i+chunk])
+            p.finish()
+        return run
+
+    return {
+        "form": {"bytes": len(form), "whole_peak": _peak(whole_form), "streamed_peak": _peak(streamed(form, FormParser))},
+        "json": {"bytes": len(body), "whole_peak": _peak(whole_json),
+                 "streamed_peak": _peak(streamed(body, lambda: JSONParser(max_depth=4))),
+                 "streamed_us": round(_ns_per_op(streamed(body, lambda: JSONParser(max_depth=4)), 20) / 1000, 1)},
+    }
+
+# request/response pooling
+
+class _Reader:
+    def __init__(self, lines):
+        self._lines = lines
+        self._i = 0
+
+    async def readline(self):
+        line = self._lines[self._i]
+        self._i += 1
+        return line
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 1)
+
+class _Writer:
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+def bench_pool(requests=2000):
+    """In-process requests to a JSON route, with the request/response pool and without it (size 0,
+    a new pair per request like before pooling). On the device compare gc.mem_alloc() instead."""
+    from WebServer.WebServer import WebServer
+
+    lines = list(_REQUEST[1:]) + [b"\r\n"]
+    out = {}
+    for name, size in (("unpooled", 0), ("pooled", None)):
+        srv = WebServer(loglevel=Logger.ERROR, static=None, pool_size=size)
+
+        @srv.route("/wifi_mode", methods="GET")
+        async def mode(req, resp):
+            resp.header("content-type", "application/json")
+            resp.body({"mode": "AP"})
+
+        async def run():
+            for _ in range(requests):
+                await srv.handle_request(_Reader([_REQUEST[0]] + lines), _Writer(), True)
+
+        asyncio.run(run())  # warm up
+        srv._pool.exhausted = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        out[name] = {"pairs_allocated": srv._pool.exhausted, "us_per_request": round(elapsed * 1e6 / requests, 1),
+                     "peak_bytes": peak}
+
+    return out
+
+# response writing
+
+class _CountingWriter:
+    def __init__(self):
+        self.writes = 0
+        self.drains = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+
+    async def drain(self):
+        self.drains += 1
+
+def bench_response(rounds=500):
+    """Writes, drains and time per response of each kind (every write is a send() on the device)."""
+    from WebServer.ResponseCache import ResponseCache
+    from WebServer.WebRequest import WebRequest
+    from WebServer.WebResponse import WebResponse
+    from WebServer.WebServer import gen_status_report
+
+    req = WebRequest("GET", "HTTP/1.1")
+    req.set_header("accept", b"application/json, */*")
+    logger = Logger.Logger("bench", loglevel=Logger.ERROR)
+    static = os.path.join(host.REPO_DIR, "static")
+    cache = ResponseCache(64 * 1024, 16 * 1024)
+    # WebServer's default file_chunk
+    buf = bytearray(512)
+
+    def json_small(resp, w):
+        resp.header("content-type", "application/json")
+        resp.body({"mode": "AP"})
+        return resp.send_internal(req, logger, w)
+
+    def json_scan(resp, w):
+        resp.header("content-type", "application/json")
+        resp.body(scan_payload(5))
+        return resp.send_internal(req, logger, w)
+
+    def html(resp, w):
+        resp.body("<h1>Not Found</h1><pre>Path not found</pre>")
+        return resp.send_internal(None, logger, w)
+
+    def error(resp, w):
+        resp.code(404)
+        resp.body(gen_status_report("error", "Path \"/nope\" not found"))
+        return resp.send_internal(req, logger, w)
+
+    def stream(resp, w):
+        resp.header("content-type", "text/plain")
+        resp.stream(["line of a log record\n" * 4] * 3)
+        return resp.send_internal(req, logger, w)
+
+    def static_cached(resp, w):
+        return resp.send_file(static + "/style.css", w, req, cache=cache)
+
+    def static_file(resp, w):
+        return resp.send_file(static + "/index.html", w, req, buf=buf)
+
+    out = {}
+    for name, fn in (("json_small", json_small), ("json_scan", json_scan), ("html", html), ("error", error),
+                     ("stream", stream), ("static_cached", static_cached), ("static_file", static_file)):
+        async def run():
+            for _ in range(rounds):
+                resp = WebResponse()
+                resp.keep_alive = True
+                resp.keep_alive_timeout = 5
+                w = _CountingWriter()
+                await fn(resp, w)
+            return w
+
+        w = asyncio.run(run())
+        start = time.perf_counter()
+        asyncio.run(run())
+        out[name] = {"writes": w.writes, "drains": w.drains, "bytes": w.bytes,
+                     "us_per_response": round((time.perf_counter() - start) * 1e6 / rounds, 1)}
+
+    return out
+
+# response cache
+
+def bench_cache(requests=2000, networks=16):
+    """In-process requests to JSON routes with cache= and without, time per request
+    and how often the route ran."""
+    from WebServer.WebServer import WebServer
+
+    out = {}
+    for kind, body in (("mode", {"mode": "AP"}), ("scan", scan_payload(networks))):
+        for name, cache in (("uncached", None), ("cached", 0)):
+            # sized like app.py
+            srv = WebServer(loglevel=Logger.ERROR, static=None, response_cache=3072, response_cache_entry=2816)
+            calls = [0]
+
+            @srv.route("/wifi_mode", methods="GET", cache=cache, tags=("wifi",))
+            async def route(req, resp):
+                calls[0] += 1
+                resp.header("content-type", "application/json")
+                resp.body(body)
+
+            async def run():
+                for _ in range(requests):
+                    await srv.handle_request(_Reader(list(_REQUEST) + [b"\r\n"]), _CountingWriter(), True)
+
+            asyncio.run(run())  # warm up
+            calls[0] = 0
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+
+            out["{}_{}".format(kind, name)] = {"us_per_request": round(elapsed * 1e6 / requests, 1),
+                                               "route_calls": calls[0], "cache_bytes": srv.response_cache.used}
+
+    return out
+
+# scan service, against the simulated network module
+
+class _ScanWiFi:
+    """Just the part of WiFi that ScanService uses, scans are counted by network.config.scans."""
+
+    def __init__(self):
+        import network
+        self._sta = network.WLAN(network.STA_IF)
+        self._sta.active(True)
+
+    def scan(self):
+        return self._sta.scan()
+
+def check_scan(clients=8, ttl=1, latency=0.2):
+    """Concurrent get()s share one scan, a stale snapshot is served right away once ttl passes
+    while one refresh runs. Raises AssertionError if either doesn't hold."""
+    import network
+    from WiFiScan import ScanService
+
+    network.configure(scan_latency=latency)
+    scanner = ScanService(_ScanWiFi(), ttl=ttl, loglevel=Logger.ERROR)
+
+    async def run():
+        out = {}
+        scans = network.config.scans
+        results = await asyncio.gather(*[scanner.get() for _ in range(clients)])
+        out["concurrent_gets"] = clients
+        out["concurrent_scans"] = network.config.scans - scans
+        assert out["concurrent_scans"] == 1, out
+        assert all(r[0] is results[0][0] for r in results), "gets saw different results"
+
+        # fresh, no scan
+        scans = network.config.scans
+        await scanner.get()
+        assert network.config.scans == scans, "scan within ttl"
+
+        await asyncio.sleep(ttl + 0.1)
+        start = time.perf_counter()
+        networks, age = await scanner.get()
+        out["stale_served_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        out["stale_age"] = age
+        assert age >= ttl and out["stale_served_ms"] < latency * 1000, out
+
+        # joins the refresh the stale get() started
+        await scanner.refresh()
+        out["refresh_scans"] = network.config.scans - scans
+        assert out["refresh_scans"] == 1, out
+        assert scanner.age() == 0
+        return out
+
+    return asyncio.run(run())
+
+def run_all():
+    return {
+        "json": bench_json(),
+        "parser": bench_parser(),
+        "router": bench_router(),
+        "logging": bench_logging(),
+        "body": bench_body(),
+        "pool": bench_pool(),
+        "response": bench_response(),
+        "cache": bench_cache(),
+        "scan": check_scan(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the request path.")
+    parser.add_argument("--out", default=None, help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run_all()
+    text = json.dumps(results, indent=2)
+    if args.out != None:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+# Benchmark suite: starts bench/server.py (the firmware on the host) in a subprocess,
+# runs the HTTP scenarios and the multicast tests against it, plus bench/micro.py,
+# and writes everything as JSON.
+#
+# Usage: python bench/run.py [--out results.json] [--baseline old.json] [--threshold 15]
+#                            [--requests 400] [--concurrency 4] [--only static-keepalive,mixed]
+#
+# Run build_static.py first, otherwise static-gzip serves the uncompressed files.
+# With --baseline the exit code is 1 if a scenario got slower (rps down or p99 up)
+# by more than threshold percent.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import loadgen
+
+# name -> (request mix, keep-alive, concurrency or None for --concurrency)
+SCENARIOS = (
+    ("static-keepalive", "static=1", True, None),
+    ("static-close", "static=1", False, None),
+    ("static-gzip", "static_gzip=1", True, None),
+    ("mode-keepalive", "mode=1", True, None),
+    ("mode-close", "mode=1", False, None),
+    ("scan", "scan=1", True, None),
+    ("notfound", "notfound=1", True, None),
+    ("malformed", "malformed=1", False, None),
+    ("mixed", "static=3,css=1,mode=3,scan=1,notfound=1,malformed=1", True, None),
+    # more connections than max_inflight, expect 503s but no errors
+    ("overload-50", "mode=3,static=1", True, 50),
+)
+
+def _get_json(port, path):
+    req = urllib.request.Request("http://127.0.0.1:{}{}".format(port, path), headers={"Accept": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+def _wait_ready(port, proc, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() != None:
+            raise RuntimeError("bench server exited with {}".format(proc.returncode))
+        try:
+            return _get_json(port, "/__bench")
+        except OSError:
+            time.sleep(0.2)
+
+    raise RuntimeError("bench server not ready after {}s".format(timeout))
+
+def _counters(port):
+    metrics = _get_json(port, "/metrics")
+    return {key: metrics[key] for key in metrics if key.endswith("_total")}
+
+def _delta(before, after):
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+
+def run_http(port, args):
+    results = []
+    for name, mix, keepalive, concurrency in SCENARIOS:
+        if args.only and name not in args.only:
+            continue
+
+        base = _get_json(port, "/__bench?reset=1")["current"]
+        before = _counters(port)
+        result = asyncio.run(loadgen.http_load("127.0.0.1", port, mix=mix, requests=args.requests,
+                                               concurrency=concurrency or args.concurrency, keepalive=keepalive))
+        # heap the scenario needed on top of what was allocated before it
+        result["server_peak_bytes"] = _get_json(port, "/__bench")["peak"] - base
+        result["counters"] = _delta(before, _counters(port))
+        result.update({"name": name, "mix": mix, "keepalive": keepalive, "concurrency": concurrency or args.concurrency})
+
+        results.append(result)
+        print("{:18} {:8.1f} rps  p99 {:7.2f}ms  {:7.1f} B/req  status {}  errors {}".format(
+            name, result["rps"], result["latency_ms"].get("p99", 0), result["bytes_per_request"],
+            result["status"], result["errors"]), flush=True)
+
+    return results
+
+def run_slowloris(port, args):
+    """Normal traffic while trickling clients hold connections open."""
+    if args.only and "slowloris" not in args.only:
+        return None
+
+    async def run():
+        slow = asyncio.create_task(loadgen.slow_clients("127.0.0.1", port, count=8, interval=0.5, duration=8))
+        await asyncio.sleep(0.5)
+        result = await loadgen.http_load("127.0.0.1", port, mix="mode", requests=args.requests // 4,
+                                         concurrency=2, keepalive=True)
+        result["slow_clients"] = 8
+        result["slow_clients_dropped"] = await slow
+        return result
+
+    before = _counters(port)
+    result = asyncio.run(run())
+    result["counters"] = _delta(before, _counters(port))
+    print("{:18} {:8.1f} rps  p99 {:7.2f}ms  slow clients dropped {}/8".format(
+        "slowloris", result["rps"], result["latency_ms"].get("p99", 0), result["slow_clients_dropped"]), flush=True)
+    return result
+
+def run_multicast(port, args):
+    if args.only and "multicast" not in args.only:
+        return None
+
+    before = _counters(port)
+    out = {
+        "ping": asyncio.run(loadgen.mcast_ping(count=50)),
+        "flood": asyncio.run(loadgen.mcast_flood(count=2000, malformed_ratio=0.1)),
+    }
+    out["counters"] = _delta(before, _counters(port))
+    print("{:18} p99 {:7.2f}ms  flood replies {}".format(
+        "multicast", out["ping"]["latency_ms"].get("p99", 0), out["flood"]["replies"]), flush=True)
+    return out
+
+def run_upload(port, args, size=48 * 1024):
+    """Streams a file to the upload route, reports the route's own KB/s and the server's peak heap."""
+    if args.only and "upload" not in args.only:
+        return None
+
+    data = os.urandom(size)
+    base = _get_json(port, "/__bench?reset=1")["current"]
+    req = urllib.request.Request("http://127.0.0.1:{}/upload/bench.bin".format(port), data=data, method="POST",
+                                 headers={"Accept": "application/json", "x-content-sha256": hashlib.sha256(data).hexdigest()})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        out = json.loads(resp.read())
+
+    out["client_kbps"] = round(size / 1024 / (time.perf_counter() - start), 1)
+    out["server_peak_bytes"] = _get_json(port, "/__bench")["peak"] - base
+    print("{:18} {} KB/s (client {})  server peak {} B".format(
+        "upload", out["kbps"], out["client_kbps"], out["server_peak_bytes"]), flush=True)
+    return out
+
+def run_sse(port, args, clients=4, interval=0.5, duration=8):
+    """Server CPU for clients subscribed to /events against as many clients polling /wifi_mode
+    at the publish interval, i.e. getting the state equally fresh."""
+    if args.only and "sse" not in args.only:
+        return None
+
+    def measure(clients_coro):
+        before = _get_json(port, "/__bench?tick={}".format(interval))
+        received = asyncio.run(clients_coro)
+        after = _get_json(port, "/__bench?tick=0")
+        return {
+            "clients": clients,
+            "received": received,
+            "ticks": after["ticks"] - before["ticks"],
+            "server_cpu_ms": round((after["cpu"] - before["cpu"]) * 1000, 1),
+        }
+
+    out = {
+        "interval_s": interval,
+        "duration_s": duration,
+        "sse": measure(loadgen.sse_clients("127.0.0.1", port, count=clients, duration=duration)),
+        "poll": measure(loadgen.pollers("127.0.0.1", port, count=clients, interval=interval, duration=duration)),
+    }
+    # one more than the hub takes, must be refused
+    out["over_limit_refused"] = asyncio.run(loadgen.sse_clients("127.0.0.1", port, count=clients + 1, duration=1)).count(None)
+
+    print("{:18} server cpu {}ms ({} subscribers) vs {}ms ({} pollers), refused over limit {}".format(
+        "sse", out["sse"]["server_cpu_ms"], clients, out["poll"]["server_cpu_ms"], clients,
+        out["over_limit_refused"]), flush=True)
+    return out
+
+def _set_config(port, values):
+    data = urllib.parse.urlencode(values).encode()
+    req = urllib.request.Request("http://127.0.0.1:{}/set_config".format(port), data=data,
+                                 headers={"Accept": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+def run_reconfig(port, args):
+    """Unreachable window of /set_config: longest gap between answered probes (new connection
+    every 50ms) while switching AP -> STA -> AP, mode-keepalive traffic running alongside."""
+    if args.only and "reconfig" not in args.only:
+        return None
+
+    async def switch(values):
+        probe = asyncio.create_task(loadgen.probe("127.0.0.1", port, interval=0.05, duration=3))
+        load = asyncio.create_task(loadgen.http_load("127.0.0.1", port, mix="mode", requests=3000,
+                                                     concurrency=2, keepalive=True))
+        await asyncio.sleep(0.5)
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, lambda: _set_config(port, values))
+        answered = round((time.perf_counter() - start) * 1000, 1)
+        gap, failed = await probe
+        result = await load
+        return {"set_config_ms": answered, "unreachable_ms": gap, "probes_failed": failed,
+                "requests_failed": result["errors"]}
+
+    out = {
+        "to_sta": asyncio.run(switch({"mode": "sta", "ssid": "home", "pass": "password"})),
+        "to_ap": asyncio.run(switch({"mode": "ap"})),
+    }
+    print("{:18} unreachable {}ms to STA, {}ms to AP, failed requests {}/{}".format(
+        "reconfig", out["to_sta"]["unreachable_ms"], out["to_ap"]["unreachable_ms"],
+        out["to_sta"]["requests_failed"], out["to_ap"]["requests_failed"]), flush=True)
+    return out
+
+def run_reconnect(port, args, outages=(0, 4)):
+    """Switches to STA on the simulated WLAN, then drops the link: reconnect times from the
+    watchdog, and requests served while the link was down (the server is not restarted).
+    Leaves the server in STA mode, runs last."""
+    if args.only and "reconnect" not in args.only:
+        return None
+
+    def wait_for(check, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                value = check()
+                if value:
+                    return value
+            except OSError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("timed out")
+
+    _set_config(port, {"mode": "sta", "ssid": "home", "pass": "password"})
+    wait_for(lambda: _get_json(port, "/wifi_mode")["mode"] == "STA")
+    out = {"first_connect_ms": _get_json(port, "/metrics")["wifi_last_connect_ms"], "drops": []}
+
+    for outage in outages:
+        before = _get_json(port, "/metrics")
+        _get_json(port, "/__bench?drop={}".format(outage))
+        served = loadgen.pollers("127.0.0.1", port, count=1, interval=0.1, duration=outage + 1)
+        served = asyncio.run(served)[0]
+        after = wait_for(lambda: (lambda m: m if m["wifi_reconnects_total"] > before["wifi_reconnects_total"] else None)(
+            _get_json(port, "/metrics")))
+        out["drops"].append({
+            "outage_s": outage,
+            "reconnect_ms": after["wifi_last_reconnect_ms"],
+            "connect_ms": after["wifi_last_connect_ms"],
+            "fast": after["wifi_sta_fast_connects_total"] - before["wifi_sta_fast_connects_total"],
+            "connect_attempts": after["wifi_sta_connects_total"] - before["wifi_sta_connects_total"],
+            "served_while_down": served,
+        })
+
+    print("{:18} first connect {}ms, reconnect {}".format("reconnect", out["first_connect_ms"], ", ".join(
+        "{}ms after {}s outage ({} attempts)".format(d["reconnect_ms"], d["outage_s"], d["connect_attempts"])
+        for d in out["drops"])), flush=True)
+    return out
+
+def compare(results, baseline, threshold):
+    """Regressions of HTTP scenarios against a previous results file."""
+    old = {s["name"]: s for s in baseline.get("http", ())}
+    regressions = []
+    for scenario in results["http"]:
+        prev = old.get(scenario["name"])
+        if prev == None or not prev["rps"] or not prev["latency_ms"]:
+            continue
+
+        rps = (scenario["rps"] - prev["rps"]) * 100 / prev["rps"]
+        p99 = (scenario["latency_ms"]["p99"] - prev["latency_ms"]["p99"]) * 100 / prev["latency_ms"]["p99"]
+        if rps < -threshold:
+            regressions.append("{}: rps {} -> {} ({:+.1f}%)".format(scenario["name"], prev["rps"], scenario["rps"], rps))
+        if p99 > threshold:
+            regressions.append("{}: p99 {} -> {} ms ({:+.1f}%)".format(
+                scenario["name"], prev["latency_ms"]["p99"], scenario["latency_ms"]["p99"], p99))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the web and multicast servers.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="connections per scenario")
+    parser.add_argument("--only", default=None, help="comma separated scenario names (slowloris, multicast, upload, sse, reconfig, reconnect included)")
+    parser.add_argument("--connect-delay", type=float, default=0.1, help="seconds a simulated STA connection takes")
+    parser.add_argument("--no-micro", action="store_true", help="skip the in-process microbenchmarks")
+    parser.add_argument("--out", default=None, help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=15, help="allowed regression in percent")
+    args = parser.parse_args()
+    args.only = set(args.only.split(",")) if args.only else None
+
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "server.py"), "--port", str(args.port),
+                               "--connect-delay", str(args.connect_delay),
+                               # multicast latency is measured from one source, don't rate limit it
+                               "--mcast-rate", "1000000", "--mcast-burst", "1000000"],
+                              stdout=subprocess.DEVNULL)
+    try:
+        _wait_ready(args.port, server)
+        # first scan blocks the loop, get it out of the way
+        _get_json(args.port, "/wifi_scan")
+
+        results = {
+            "meta": {"time": int(time.time()), "python": platform.python_version(), "machine": platform.machine(),
+                     "requests": args.requests, "concurrency": args.concurrency},
+            "http": run_http(args.port, args),
+            "slowloris": run_slowloris(args.port, args),
+            "multicast": run_multicast(args.port, args),
+            "upload": run_upload(args.port, args),
+            "sse": run_sse(args.port, args),
+            "reconfig": run_reconfig(args.port, args),
+            "reconnect": run_reconnect(args.port, args),
+        }
+
+    finally:
+        server.terminate()
+        server.wait()
+
+    if not args.no_micro:
+        import micro
+        results["micro"] = micro.run_all()
+
+    if args.out != None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print("results written to {}".format(args.out))
+
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Firmware under test for bench/run.py: boots app.py on the host (see sim/host.py)
+# with tracemalloc on, and adds a /__bench route reporting the process' peak Python heap
+# and CPU time. /__bench?tick=<seconds> publishes a "tick" event to /events subscribers
+# every <seconds> (0 stops it). /__bench?drop=<seconds> takes the simulated STA link down
+# with the access points gone for <seconds> (see network.drop_link).
+#
+# Usage: python bench/server.py [--port 8099] [--max-inflight N] [--mcast-rate R] [--mcast-burst B]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "sim"))
+import host
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the firmware for benchmarking.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--root", default=None)
+    parser.add_argument("--scan-latency", type=float, default=0.2)
+    parser.add_argument("--connect-delay", type=float, default=0.1)
+    parser.add_argument("--fast-connect-delay", type=float, default=0.02)
+    parser.add_argument("--max-inflight", type=int, default=None, help="override WebServer max_inflight")
+    parser.add_argument("--mcast-rate", type=float, default=None, help="override the multicast per-source rate limit")
+    parser.add_argument("--mcast-burst", type=int, default=None)
+    parser.add_argument("--loglevel", default="INFO", help="app log level (DEBUG logs every request)")
+    args = parser.parse_args()
+
+    host.install(port_map={80: args.port})
+
+    import network
+    network.configure(scan_latency=args.scan_latency, connect_delay=args.connect_delay,
+                      fast_connect_delay=args.fast_connect_delay)
+    host.make_root(args.root)
+
+    tracemalloc.start()
+
+    import Logger.Logger as Logger
+    import app
+    from WebServer.HTTPException import OK
+
+    level = getattr(Logger, args.loglevel)
+    for logger in (app.logger, app.srv.logger, app.mcast._logger, app.scanner.logger, app.wifi.logger):
+        logger.loglevel = level
+
+    if args.max_inflight != None:
+        app.srv._max_inflight = args.max_inflight
+    if args.mcast_rate != None:
+        app.mcast._limiter.rate = args.mcast_rate
+        app.mcast._limiter.global_rate = args.mcast_rate
+    if args.mcast_burst != None:
+        app.mcast._limiter.burst = args.mcast_burst
+        app.mcast._limiter.global_burst = args.mcast_burst
+
+    import uasyncio as asyncio
+    ticker = {"task": None, "n": 0}
+
+    async def tick(interval):
+        while True:
+            ticker["n"] += 1
+            app.events.publish("tick", {"n": ticker["n"], "mode": app.wifi.get_mode_str()})
+            await asyncio.sleep(interval)
+
+    @app.srv.route("/__bench", methods="GET")
+    async def bench_stats(req, resp):
+        current, peak = tracemalloc.get_traced_memory()
+        if req.has_urldata("reset"):
+            tracemalloc.reset_peak()
+
+        if req.has_urldata("tick"):
+            if ticker["task"] != None:
+                ticker["task"].cancel()
+                ticker["task"] = None
+            interval = float(req.get_urldata("tick"))
+            if interval > 0:
+                ticker["task"] = asyncio.create_task(tick(interval))
+
+        if req.has_urldata("drop"):
+            network.drop_link(float(req.get_urldata("drop")))
+
+        resp.header("content-type", "application/json")
+        resp.body({"current": current, "peak": peak, "cpu": time.process_time(), "ticks": ticker["n"]})
+
+    print("bench server ready on port {}".format(args.port), flush=True)
+    app.start()
+
+if __name__ == "__main__":
+    main()
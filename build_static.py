@@ -0,0 +1,60 @@
+# Host-side build step (CPython), run before uploading static files to the device.
+#
+# Writes precompressed <file>.gz variants (only when smaller than the original)
+# and a <static>.manifest next to the static folder, with content hashes used as ETags:
+#   /index.html=<hash>
+#   /index.html.gz=<hash>
+# The manifest uses config_parser format so the device can read it with read_dict.
+#
+# Usage: python build_static.py [static_folder]
+
+import gzip
+import hashlib
+import os
+import sys
+
+HASH_LEN = 16
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+def build(static):
+    static = static.rstrip("/")
+    manifest = {}
+
+    for root, _, files in os.walk(static):
+        for name in sorted(files):
+            if name.endswith(".gz"):
+                continue
+
+            path = os.path.join(root, name)
+            key = "/" + os.path.relpath(path, static).replace(os.sep, "/")
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            manifest[key] = content_hash(data)
+
+            # mtime=0 keeps the output (and its hash) reproducible
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                with open(path + ".gz", "wb") as f:
+                    f.write(compressed)
+
+                manifest[key + ".gz"] = content_hash(compressed)
+                print("{}: {} -> {} bytes".format(key, len(data), len(compressed)))
+
+            else:
+                if os.path.exists(path + ".gz"):
+                    os.remove(path + ".gz")
+
+                print("{}: {} bytes, not compressed".format(key, len(data)))
+
+    with open(static + ".manifest", "w") as f:
+        for key in sorted(manifest):
+            f.write(key + "=" + manifest[key] + "\n")
+
+    print("manifest written to {}.manifest".format(static))
+
+if __name__ == "__main__":
+    build(sys.argv[1] if len(sys.argv) > 1 else "static")
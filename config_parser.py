@@ -1,4 +1,5 @@
 import os
+import binascii
 
 # Throws
 def read_dict(path):
@@ -17,4 +18,134 @@ def save_dict(path, dict):
         val = str(dict[key])
         f.write(key+"="+val+"\n")
 
-    f.close()
\ No newline at end of file
+    f.close()
+
+# last line of a ConfigStore file, crc32 of everything before it
+_CRC_PREFIX = "#crc="
+
+def _crc(text):
+    return "{:08x}".format(binascii.crc32(text.encode()) & 0xffffffff)
+
+def _to_str(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+
+    return str(value)
+
+def _from_str(kind, text):
+    if kind == bool:
+        if text not in ("0", "1"):
+            raise ValueError("bad bool {}".format(text))
+        return text == "1"
+
+    return kind(text)
+
+class ConfigStore:
+    """Typed key=value config file, parsed once and kept in memory.
+
+    types maps every key to int, str or bool, other keys in the file are ignored.
+    Writes go to a temporary file renamed over the old one, with a checksum line at the end,
+    so a reset mid-write leaves the previous config. Writing the content already on flash is skipped."""
+
+    def __init__(self, path, types):
+        self.path = path
+        self._types = types
+        # None until loaded
+        self._values = None
+        # file content (without checksum) currently on flash, None if there's no valid file
+        self._stored = None
+
+        self.writes = 0
+        self.elided = 0
+
+    def _encode(self, values):
+        out = ""
+        # sorted, same values always give the same text
+        for key in sorted(values):
+            out += key + "=" + _to_str(values[key]) + "\n"
+
+        return out
+
+    def _parse(self, text):
+        values = {}
+        for line in text.split("\n"):
+            if not line:
+                continue
+
+            key, sep, val = line.partition("=")
+            if not sep:
+                raise ValueError("no = in line")
+
+            if key in self._types:
+                values[key] = _from_str(self._types[key], val)
+
+        return values
+
+    def load(self):
+        """Returns the config dict (don't modify it, use set), empty if the file is missing or corrupted."""
+        if self._values != None:
+            return self._values
+
+        self._values = {}
+        try:
+            with open(self.path, "r") as f:
+                text = f.read()
+        except OSError:
+            return self._values
+
+        body, sep, crc = text.rpartition(_CRC_PREFIX)
+        if sep:
+            if crc.strip() != _crc(body):
+                return self._values
+        else:
+            # written by save_dict before checksums, accepted only if it wasn't cut off
+            if not text.endswith("\n"):
+                return self._values
+            body = None
+
+        try:
+            self._values = self._parse(text if body == None else body)
+        except ValueError:
+            return self._values
+
+        self._stored = body
+        return self._values
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    def set(self, key, value):
+        """Changes value in memory, commit() writes it."""
+        kind = self._types[key]
+        if not isinstance(value, kind) or (kind == int and isinstance(value, bool)):
+            raise ValueError("{} must be {}".format(key, kind.__name__))
+
+        if kind == str and "\n" in value:
+            raise ValueError("{} can't contain a new line".format(key))
+
+        self.load()[key] = value
+
+    def replace(self, values):
+        """Sets the whole config (keys not in values are dropped) and commits. Returns True if flash was written."""
+        self.load().clear()
+        for key in values:
+            self.set(key, values[key])
+
+        return self.commit()
+
+    def commit(self):
+        """Writes the config if it differs from the file. Returns True if flash was written."""
+        body = self._encode(self.load())
+        if body == self._stored:
+            self.elided += 1
+            return False
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(body)
+            f.write(_CRC_PREFIX + _crc(body) + "\n")
+
+        os.rename(tmp, self.path)
+        self._stored = body
+        self.writes += 1
+        return True
@@ -0,0 +1,71 @@
+# Makes the firmware importable and runnable on CPython (Linux host).
+#
+# install() puts the stand-in modules (uasyncio, network, micropython) on sys.path
+# and adds the MicroPython-only functions the code uses to CPython's time and gc.
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIM_DIR)
+
+# reported by gc.mem_free(), roughly what is left on an ESP8266 after boot
+HEAP_FREE = 32 * 1024
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+def _ticks_us():
+    return int(time.monotonic() * 1000000)
+
+def _ticks_diff(a, b):
+    return a - b
+
+def _ticks_add(a, b):
+    return a + b
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+def install(heap_free=HEAP_FREE, port_map=None):
+    for path in (REPO_DIR, SIM_DIR):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_diff = _ticks_diff
+    time.ticks_add = _ticks_add
+    time.sleep_ms = _sleep_ms
+
+    gc.mem_free = lambda: heap_free
+    gc.mem_alloc = lambda: 0
+
+    import uasyncio
+    if port_map:
+        uasyncio.PORT_MAP.update(port_map)
+
+def make_root(root=None):
+    """Device filesystem root: a directory with a copy of the repository's static folder,
+    config files written by the firmware land there. Becomes the working directory."""
+
+    if root == None:
+        root = tempfile.mkdtemp(prefix="devroot-")
+
+    os.makedirs(root, exist_ok=True)
+    for name in ("static", "static.manifest"):
+        src = os.path.join(REPO_DIR, name)
+        dst = os.path.join(root, name)
+        # copies, uploads replace files in the device root and not in the repository
+        if os.path.isdir(src) and not os.path.lexists(dst):
+            shutil.copytree(src, dst)
+        elif os.path.exists(src) and not os.path.lexists(dst):
+            shutil.copy(src, dst)
+
+    os.chdir(root)
+    return root
@@ -0,0 +1,9 @@
+# micropython module stand-in (host simulation only).
+
+import gc
+
+def const(x):
+    return x
+
+def mem_info(verbose=None):
+    print("mem: free {} (simulated)".format(gc.mem_free()))
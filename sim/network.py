@@ -0,0 +1,152 @@
+# Simulated network module (host simulation only).
+#
+# Behaviour is set with configure(), i.e. how long a connection takes, how long
+# a scan blocks (like the firmware call, it blocks the whole event loop) and what it returns.
+# drop_link() takes the STA link down, i.e. to exercise the WiFi link watchdog.
+
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = 2
+STAT_NO_AP_FOUND = 3
+STAT_CONNECT_FAIL = 4
+STAT_GOT_IP = 5
+
+class _Config:
+    # seconds from connect() to isconnected()
+    connect_delay = 1.0
+    # same, connect() given the BSSID of the network skips the scan for it
+    fast_connect_delay = 0.2
+    # seconds a scan() blocks
+    scan_latency = 1.5
+    # ssid -> password, connect() to anything else fails
+    passwords = {"home": "password"}
+    # scan() results: (ssid, bssid, channel, rssi, authmode, hidden)
+    networks = [
+        (b"home", b"\x12\x34\x56\x78\x9a\xbc", 6, -52, 3, False),
+        (b"neighbour", b"\x12\x34\x56\x78\x9a\xbd", 11, -77, 4, False),
+        (b"cafe", b"\x12\x34\x56\x78\x9a\xbe", 1, -85, 0, False)
+    ]
+    # addresses the interfaces get, loopback keeps everything reachable on the host
+    sta_ip = "127.0.0.1"
+    ap_ip = "127.0.0.1"
+
+    # monotonic time the access points are back after drop_link()
+    outage_until = 0
+
+    scans = 0
+    connects = 0
+
+config = _Config
+
+def configure(**kwargs):
+    for key in kwargs:
+        if not hasattr(_Config, key):
+            raise AttributeError("unknown simulation setting {}".format(key))
+
+        setattr(_Config, key, kwargs[key])
+
+def drop_link(outage=0):
+    """Disconnects the STA interface, connect() finds no network for outage seconds."""
+    _Config.outage_until = time.monotonic() + outage
+    if STA_IF in _interfaces:
+        _interfaces[STA_IF].disconnect()
+
+class _WLAN:
+    def __init__(self, interface):
+        self._if = interface
+        self._active = False
+        self._ssid = None
+        self._essid = None
+        self._status = STAT_IDLE
+        # monotonic time the pending connection completes
+        self._connected_at = None
+
+    def active(self, is_active=None):
+        if is_active == None:
+            return self._active
+
+        self._active = bool(is_active)
+        if not self._active:
+            self.disconnect()
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        if not self._active:
+            raise OSError("interface not active")
+
+        _Config.connects += 1
+        self._ssid = ssid
+        delay = _Config.connect_delay
+        if bssid != None:
+            found = [net for net in _Config.networks if net[0].decode() == ssid and net[1] == bssid]
+            delay = _Config.fast_connect_delay if found else None
+
+        if time.monotonic() < _Config.outage_until or delay == None:
+            self._status = STAT_NO_AP_FOUND
+            self._connected_at = None
+        elif _Config.passwords.get(ssid) == password:
+            self._status = STAT_CONNECTING
+            self._connected_at = time.monotonic() + delay
+        else:
+            self._status = STAT_WRONG_PASSWORD
+            self._connected_at = None
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+        self._connected_at = None
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -60
+
+        if self._status == STAT_CONNECTING and time.monotonic() >= self._connected_at:
+            self._status = STAT_GOT_IP
+
+        return self._status
+
+    def isconnected(self):
+        if self._if == AP_IF:
+            return self._active
+
+        return self.status() == STAT_GOT_IP
+
+    def scan(self):
+        if self._if != STA_IF or not self._active:
+            raise OSError("STA interface not active")
+
+        _Config.scans += 1
+        time.sleep(_Config.scan_latency)
+        return list(_Config.networks)
+
+    def ifconfig(self):
+        if self._if == AP_IF:
+            ip = _Config.ap_ip if self._active else "0.0.0.0"
+        else:
+            ip = _Config.sta_ip if self.isconnected() else "0.0.0.0"
+
+        return (ip, "255.255.255.0", ip, "8.8.8.8")
+
+    def config(self, *args, **kwargs):
+        if "essid" in kwargs:
+            self._essid = kwargs["essid"]
+
+        if args:
+            if args[0] == "essid":
+                return self._essid if self._if == AP_IF else self._ssid
+            if args[0] == "mac":
+                return b"\x5c\xcf\x7f\x00\x00\x01"
+
+        return None
+
+# like the firmware, one object per interface
+_interfaces = {}
+
+def WLAN(interface=STA_IF):
+    if interface not in _interfaces:
+        _interfaces[interface] = _WLAN(interface)
+
+    return _interfaces[interface]
@@ -0,0 +1,35 @@
+# Boots main.py on the host: real HTTP and multicast on loopback, simulated Wi-Fi.
+#
+# Usage: python sim/run.py [--port 8080] [--root DIR] [--connect-delay S] [--scan-latency S]
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import host
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the firmware on the host.")
+    parser.add_argument("--port", type=int, default=8080, help="host port for the web server (80 on the device)")
+    parser.add_argument("--root", default=None, help="device filesystem root (temporary directory by default)")
+    parser.add_argument("--connect-delay", type=float, default=None, help="seconds a STA connection takes")
+    parser.add_argument("--scan-latency", type=float, default=None, help="seconds a scan blocks")
+    parser.add_argument("--heap-free", type=int, default=host.HEAP_FREE, help="value reported by gc.mem_free()")
+    args = parser.parse_args()
+
+    host.install(heap_free=args.heap_free, port_map={80: args.port})
+
+    import network
+    if args.connect_delay != None:
+        network.configure(connect_delay=args.connect_delay)
+    if args.scan_latency != None:
+        network.configure(scan_latency=args.scan_latency)
+
+    root = host.make_root(args.root)
+    print("device root: {}, http port: {}".format(root, args.port))
+
+    import main
+
+if __name__ == "__main__":
+    main()
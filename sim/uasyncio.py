@@ -0,0 +1,64 @@
+# uasyncio on top of CPython asyncio (host simulation only).
+
+import asyncio as _asyncio
+from asyncio import *
+
+# port the firmware asks for -> port actually bound on the host (see host.install)
+PORT_MAP = {}
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+class _IOQueue:
+    def queue_read(self, sock):
+        """Future done when sock is readable, yielded by awaitables like uasyncio's own streams."""
+        loop = _asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def ready():
+            if not fut.done():
+                fut.set_result(None)
+
+        loop.add_reader(sock.fileno(), ready)
+        fut.add_done_callback(lambda f: loop.remove_reader(sock.fileno()))
+
+        # accepted by the CPython Task when yielded from __await__
+        fut._asyncio_future_blocking = True
+        return fut
+
+class core:
+    _io_queue = _IOQueue()
+
+class _Reader:
+    """MicroPython streams are reader and writer at once, peername is asked on the reader."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    def get_extra_info(self, name):
+        return self._writer.get_extra_info(name)
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+class _Writer:
+    """uasyncio accepts str in write()."""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+
+        self._writer.write(buf)
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+async def start_server(callback, host, port, backlog=5):
+    async def wrapped(reader, writer):
+        await callback(_Reader(reader, writer), _Writer(writer))
+
+    return await _asyncio.start_server(wrapped, host, PORT_MAP.get(port, port), backlog=backlog, reuse_address=True)